@@ -1,9 +1,10 @@
-from typing import Dict, Any, List
+import sys
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 
-from linebot.v3.messaging import (
+from linebot.v3.messaging import (  # type: ignore
     FlexBox,
     FlexText,
-    FlexImage,
     FlexButton,
     FlexSeparator,
     FlexBubble,
@@ -12,10 +13,24 @@ from linebot.v3.messaging import (
 )
 
 
-def build_property_card(p: Dict[str, Any], include_actions: bool = False) -> FlexBubble:
+_LBL_DETAIL = sys.intern("Details")
+_LBL_BOOK = sys.intern("Book viewing")
+_LBL_CANCEL = sys.intern("Cancel booking")
+
+
+def _property_card_dict(p: Dict[str, Any], include_actions: bool = False) -> Dict[str, Any]:
+    """LINE wire-format bubble for a property, built without Flex model validation."""
     title = p.get("title", "Property")
     price = p.get("price", "")
-    image = p.get("thumbnail_url") or (p.get("image_urls", ",").split(",")[0] if p.get("image_urls") else None)
+    # rows hold raw cell values, so numbers need their thousands separators back
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        price = f"{int(price):,}" if float(price).is_integer() else f"{price:,}"
+    image = p.get("thumbnail_url")
+    if not image:
+        # first of the comma-separated gallery, without splitting the whole list
+        image_urls = p.get("image_urls")
+        if image_urls:
+            image, _, _ = image_urls.partition(",")
     bedrooms = p.get("bedrooms", "?")
     bathrooms = p.get("bathrooms", "?")
     address = p.get("address", "")
@@ -24,49 +39,80 @@ def build_property_card(p: Dict[str, Any], include_actions: bool = False) -> Fle
     body_contents: List[Any] = []
     if image:
         body_contents.append(
-            FlexImage(url=image, size="full", aspect_mode="cover", aspect_ratio="20:13")
+            {"type": "image", "url": image, "size": "full", "aspectMode": "cover", "aspectRatio": "20:13"}
         )
     body_contents.append(
-        FlexBox(
-            layout="vertical",
-            spacing="sm",
-            contents=[
-                FlexText(text=title, weight="bold", size="lg", wrap=True),
-                FlexText(text=f"฿{price} • {bedrooms}BR/{bathrooms}BA", size="sm", color="#666666", wrap=True),
-                FlexText(text=area or address, size="sm", color="#888888", wrap=True),
+        {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {"type": "text", "text": str(title), "weight": "bold", "size": "lg", "wrap": True},
+                {"type": "text", "text": f"฿{price} • {bedrooms}BR/{bathrooms}BA", "size": "sm", "color": "#666666", "wrap": True},
+                {"type": "text", "text": str(area or address), "size": "sm", "color": "#888888", "wrap": True},
             ],
-        )
+        }
     )
 
     footer_contents: List[Any] = []
     footer_contents.append(
-        FlexButton(
-            style="link",
-            height="sm",
-            action=PostbackAction(label="Details", data=f"action=detail&pid={p.get('id')}")
-        )
+        {
+            "type": "button",
+            "style": "link",
+            "height": "sm",
+            "action": {"type": "postback", "label": _LBL_DETAIL, "data": "action=detail&pid=" + str(p.get("id"))},
+        }
     )
     if include_actions:
-        footer_contents.append(FlexSeparator())
+        footer_contents.append({"type": "separator"})
         footer_contents.append(
-            FlexButton(
-                style="link",
-                height="sm",
-                action=PostbackAction(label="Book viewing", data=f"action=book&pid={p.get('id')}")
-            )
+            {
+                "type": "button",
+                "style": "link",
+                "height": "sm",
+                "action": {"type": "postback", "label": _LBL_BOOK, "data": "action=book&pid=" + str(p.get("id"))},
+            }
         )
 
-    return FlexBubble(
-        hero=None,
-        body=FlexBox(layout="vertical", contents=body_contents, spacing="md"),
-        footer=FlexBox(layout="vertical", contents=footer_contents, spacing="sm"),
-    )
+    return {
+        "type": "bubble",
+        "body": {"type": "box", "layout": "vertical", "contents": body_contents, "spacing": "md"},
+        "footer": {"type": "box", "layout": "vertical", "contents": footer_contents, "spacing": "sm"},
+    }
+
+
+def build_property_card(p: Dict[str, Any], include_actions: bool = False) -> FlexBubble:
+    return FlexBubble.from_dict(_property_card_dict(p, include_actions))
+
+
+# Property fields that affect the rendered card
+_CARD_FIELDS = (
+    "id", "title", "price", "thumbnail_url", "image_urls",
+    "bedrooms", "bathrooms", "address", "neighborhood",
+)
+
 
+@lru_cache(maxsize=1024)
+def _cached_card_dict(fields: Tuple[Any, ...], include_actions: bool) -> Dict[str, Any]:
+    p = {k: v for k, v in zip(_CARD_FIELDS, fields) if v is not None}
+    return _property_card_dict(p, include_actions)
 
-def build_property_carousel(bubbles: List[FlexBubble]) -> FlexContainer:
+
+def property_card_dict(p: Dict[str, Any], include_actions: bool = False) -> Dict[str, Any]:
+    """Wire-format dict of a property card, serialized once per distinct listing.
+
+    The result is shared between calls and must not be mutated.
+    """
+    return _cached_card_dict(tuple(p.get(k) for k in _CARD_FIELDS), include_actions)
+
+
+def build_property_carousel(props: List[Dict[str, Any]], next_data: Optional[str] = None) -> FlexContainer:
+    contents = [property_card_dict(p) for p in props]
+    if next_data:
+        contents.append(_pagination_bubble_dict("More results", next_data))
     payload = {
         "type": "carousel",
-        "contents": [b.to_dict() for b in bubbles]
+        "contents": contents
     }
     return FlexContainer.from_dict(payload)
 
@@ -88,23 +134,28 @@ def build_booking_confirmation_bubble(p: Dict[str, Any], b: Dict[str, Any]) -> F
     footer = FlexBox(
         layout="vertical",
         contents=[
-            FlexButton(style="link", height="sm", action=PostbackAction(label="Details", data=f"action=detail&pid={p.get('id')}")),
+            FlexButton(style="link", height="sm", action=PostbackAction(label=_LBL_DETAIL, data="action=detail&pid=" + str(p.get("id")))),
             FlexSeparator(),
-            FlexButton(style="link", height="sm", action=PostbackAction(label="Cancel booking", data=f"action=cancel&bid={booking_id}")),
+            FlexButton(style="link", height="sm", action=PostbackAction(label=_LBL_CANCEL, data="action=cancel&bid=" + str(booking_id))),
         ],
         spacing="sm"
     )
     return FlexBubble(body=body, footer=footer)
 
 
-def build_pagination_bubble(label: str, data: str) -> FlexBubble:
-    body = FlexBox(
-        layout="vertical",
-        contents=[FlexText(text=label, weight="bold", size="md")]
-    )
-    footer = FlexBox(
-        layout="vertical",
-        contents=[FlexButton(style="link", height="sm", action=PostbackAction(label="Next", data=data))]
-    )
-    return FlexBubble(body=body, footer=footer)
-
+def _pagination_bubble_dict(label: str, data: str) -> Dict[str, Any]:
+    return {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [{"type": "text", "text": label, "weight": "bold", "size": "md"}],
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {"type": "button", "style": "link", "height": "sm", "action": {"type": "postback", "label": "Next", "data": data}}
+            ],
+        },
+    }
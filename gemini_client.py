@@ -1,100 +1,280 @@
 import os
-import json
-import re
-import aiohttp
+import asyncio
+import copy
+import logging
+from collections import OrderedDict
+from typing import Any, Dict
+
+import httpx
+import msgspec
+import orjson
+
+from intent_rules import needs_llm, refines_context, regex_intent
+
+
+logger = logging.getLogger("realestate-bot")
+
+
+class Filters(msgspec.Struct, omit_defaults=True):
+    price_max: int | None = None
+    price_min: int | None = None
+    bedrooms: int | None = None
+    bathrooms: int | None = None
+    neighborhood: str | None = None
+    area: str | None = None
+    property_type: str | None = None
+    property_id: str | int | None = None
+    booking_id: str | int | None = None
+    cursor: int | None = None
+
+
+class Intent(msgspec.Struct):
+    name: str
+    filters: Filters = msgspec.field(default_factory=Filters)
+
+
+class _BatchIntent(msgspec.Struct):
+    i: int
+    name: str
+    filters: Filters = msgspec.field(default_factory=Filters)
+
+
+# strict=False lets numeric strings like "60000" through as ints
+_INTENT_DEC = msgspec.json.Decoder(Intent, strict=False)
+_BATCH_DEC = msgspec.json.Decoder(list[_BatchIntent], strict=False)
+
+_SYSTEM_PROMPT = (
+    "You are an intent parser for a real estate chatbot.\n"
+    "Task: extract one intent and filters as minified JSON.\n"
+    "Intents: browse, search, detail, book, my_bookings, cancel, fallback.\n"
+    "Filters: price_max, price_min, bedrooms, bathrooms, neighborhood (area), property_type, property_id, booking_id.\n"
+    "Use conversation context if present (last area/type/budget).\n"
+    "Answer ONLY JSON like {\"name\":\"search\",\"filters\":{...}} with no prose."
+)
+
+_BATCH_PROMPT = (
+    "You are an intent parser for a real estate chatbot.\n"
+    "Each input line is a JSON object {\"i\":row,\"context\":{...},\"text\":message} from a different user.\n"
+    "Parse each line independently: extract one intent and filters per message.\n"
+    "Intents: browse, search, detail, book, my_bookings, cancel, fallback.\n"
+    "Filters: price_max, price_min, bedrooms, bathrooms, neighborhood (area), property_type, property_id, booking_id.\n"
+    "Use that line's context if present (last area/type/budget).\n"
+    "Answer ONLY a minified JSON array like [{\"i\":0,\"name\":\"search\",\"filters\":{...}}] with one element per line and no prose."
+)
+
+
+# Prompts keep the static instructions first and per-request text last so
+# the shared prefix is eligible for Gemini's implicit context caching
+def _user_part(text: str) -> bytes:
+    return orjson.dumps({"role": "user", "parts": [{"text": text}]})
+
+
+# The instruction messages never change: serialize them once and splice the
+# per-request messages in as bytes
+_SYSTEM_PART = _user_part(_SYSTEM_PROMPT)
+_BATCH_PART = _user_part(_BATCH_PROMPT)
+
+
+def _contents_body(parts: list) -> bytes:
+    return b'{"contents":[' + b",".join(parts) + b"]}"
 
 
 class GeminiNLU:
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise RuntimeError("GEMINI_API_KEY is required")
-        model = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
-        self.endpoint = (
-            "https://generativelanguage.googleapis.com/v1beta/models/" \
-            + model + ":generateContent?key=" + self.api_key
-        )
+    def __init__(self) -> None:
+        self.api_key = os.getenv("GEMINI_API_KEY") or ""
+        # Without a key run regex-only instead of failing (GEMINI_REQUIRED=1 restores the error)
+        self._enabled = bool(self.api_key)
+        if not self._enabled:
+            if os.getenv("GEMINI_REQUIRED") == "1":
+                raise RuntimeError("GEMINI_API_KEY is required")
+            logger.warning("GEMINI_API_KEY not set; intent parsing uses regex only")
+        self.endpoint = ""
+        if self._enabled:
+            model = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
+            self.endpoint = (
+                "https://generativelanguage.googleapis.com/v1beta/models/" \
+                + model + ":streamGenerateContent?alt=sse&key=" + self.api_key
+            )
+        self._client: httpx.AsyncClient | None = None
+        # excess requests queue here instead of tripping connection limits or 429s
+        self._sem = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "32")))
+        # LRU of parsed intents keyed on (normalized text, context)
+        self._intent_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._intent_cache_size = int(os.getenv("GEMINI_CACHE_SIZE", "2048"))
+        # micro-batching of concurrent Gemini calls
+        self._pending: list[tuple[str, dict, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._batch_window = int(os.getenv("GEMINI_BATCH_WINDOW_MS", "20")) / 1000.0
+        self._batch_max = int(os.getenv("GEMINI_BATCH_MAX", "8"))
+        self._tasks: set = set()
+        # single-flight map of Gemini requests currently in progress
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # One pooled HTTP/2 client: concurrent parses multiplex over one TLS connection
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=20.0,
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("GEMINI_HTTP_LIMIT", "100")),
+                    max_keepalive_connections=50,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
 
     async def parse_intent(self, user_text: str, session_context: dict | None = None) -> dict:
-        # Try LLM first
-        intent = await self._parse_with_gemini(user_text, session_context or {})
-        if intent:
+        # Cheap regex first; only ambiguous messages pay for a Gemini call
+        intent = self._regex_intent(user_text)
+        if not self._enabled:
+            return intent
+        if (
+            intent["name"] != "fallback"
+            and not needs_llm(user_text, intent)
+            and not refines_context(intent, session_context)
+        ):
+            logger.debug("intent via regex: %s", intent["name"])
+            return intent
+        key = self._cache_key(user_text, session_context or {})
+        cached = self._intent_cache.get(key)
+        if cached is not None:
+            self._intent_cache.move_to_end(key)
+            logger.debug("intent via cache: %s", cached.get("name"))
+            return copy.deepcopy(cached)
+        parsed = await self._parse_with_gemini(user_text, session_context or {})
+        if not parsed:
+            logger.debug("intent via regex (gemini unavailable): %s", intent["name"])
             return intent
-        # Fallback to regex
-        return self._regex_intent(user_text)
+        logger.debug("intent via gemini: %s", parsed.get("name"))
+        # don't pin a miss: the next attempt may parse better
+        if parsed.get("name") != "fallback":
+            self._intent_cache[key] = copy.deepcopy(parsed)
+            if len(self._intent_cache) > self._intent_cache_size:
+                self._intent_cache.popitem(last=False)
+        return parsed
 
-    async def _parse_with_gemini(self, user_text: str, session_context: dict) -> dict:
-        system_prompt = (
-            "You are an intent parser for a real estate chatbot.\n"
-            "Task: extract one intent and filters as minified JSON.\n"
-            "Intents: browse, search, detail, book, my_bookings, cancel, fallback.\n"
-            "Filters: price_max, price_min, bedrooms, bathrooms, neighborhood (area), property_type, property_id, booking_id.\n"
-            "Use conversation context if present (last area/type/budget).\n"
-            "Answer ONLY JSON like {\"name\":\"search\",\"filters\":{...}} with no prose."
+    @staticmethod
+    def _cache_key(user_text: str, session_context: dict) -> tuple:
+        # "2 bed  in Ari" and "2 bed in ari" parse the same; context values
+        # may be nested dicts, so key on their canonical JSON
+        return (
+            " ".join(user_text.lower().split()),
+            orjson.dumps(session_context, option=orjson.OPT_SORT_KEYS, default=str),
         )
-        payload = {
-            "contents": [
-                {"role": "user", "parts": [{"text": system_prompt}]},
-                {"role": "user", "parts": [{"text": "Context:" + json.dumps(session_context or {})}]},
-                {"role": "user", "parts": [{"text": "User:" + user_text}]}
-            ]
-        }
 
+    async def _parse_with_gemini(self, user_text: str, session_context: dict) -> dict:
+        # Single-flight: identical concurrent messages share one request
+        key = self._cache_key(user_text, session_context)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return copy.deepcopy(await inflight)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        result = None
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.endpoint, json=payload, timeout=20) as resp:
-                    if resp.status != 200:
-                        return None
-                    data = await resp.json()
+            result = await self._enqueue(user_text, session_context)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _enqueue(self, user_text: str, session_context: dict) -> dict:
+        # Queue the message; requests arriving within the batch window share
+        # one Gemini call (see _flush)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((user_text, session_context, fut))
+        if len(self._pending) >= self._batch_max:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._batch_window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch = self._pending[:self._batch_max]
+            self._pending = self._pending[self._batch_max:]
+            task = asyncio.get_running_loop().create_task(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: list):
+        try:
+            if len(batch) == 1:
+                text, ctx, _ = batch[0]
+                results = [await self._request_one(text, ctx)]
+            else:
+                results = await self._request_many([(text, ctx) for text, ctx, _ in batch])
+        except Exception:
+            results = [None] * len(batch)
+        for (_, _, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _request_one(self, user_text: str, session_context: dict) -> dict | None:
+        parts = [_SYSTEM_PART]
+        if session_context:
+            parts.append(_user_part("Context:" + orjson.dumps(session_context, default=str).decode()))
+        parts.append(_user_part("User:" + user_text))
+        parsed = await self._generate(_contents_body(parts), _INTENT_DEC)
+        return msgspec.to_builtins(parsed) if parsed is not None else None
+
+    async def _request_many(self, rows: list) -> list:
+        lines = [
+            orjson.dumps({"i": i, "context": ctx or {}, "text": text}, default=str).decode()
+            for i, (text, ctx) in enumerate(rows)
+        ]
+        results: list = [None] * len(rows)
+        parsed = await self._generate(_contents_body([_BATCH_PART, _user_part("\n".join(lines))]), _BATCH_DEC)
+        for item in parsed or []:
+            if 0 <= item.i < len(results) and item.name:
+                results[item.i] = msgspec.to_builtins(Intent(name=item.name, filters=item.filters))
+        return results
+
+    async def _generate(self, body: bytes, decoder: msgspec.json.Decoder):
+        """POST a serialized prompt and return the model's answer decoded with ``decoder``.
+
+        The answer is streamed as server-sent events; reading stops as soon as
+        the accumulated text decodes against the schema.
+        """
+        try:
+            client = await self._get_client()
+            async with self._sem, client.stream(
+                "POST",
+                self.endpoint,
+                content=body,
+                headers={"content-type": "application/json"},
+            ) as resp:
+                if resp.status_code != 200:
+                    return None
+                text = ""
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
                     try:
-                        text = data["candidates"][0]["content"]["parts"][0]["text"]
-                        return json.loads(text)
+                        event = orjson.loads(line[5:])
+                        text += event["candidates"][0]["content"]["parts"][0]["text"]
                     except Exception:
-                        return None
+                        continue
+                    try:
+                        parsed = decoder.decode(text)
+                    except msgspec.DecodeError:
+                        continue
+                    # leaving the block drops the rest of the stream
+                    return parsed
+                return None
         except Exception:
             return None
 
-    def _regex_intent(self, text: str) -> dict:
-        q = text.lower().strip()
-        # normalize spaces
-        q = ' '.join(q.split())
-        if q.startswith("browse"):
-            return {"name": "browse", "filters": {}}
-        if q.startswith("my bookings"):
-            return {"name": "my_bookings", "filters": {}}
-        m = re.match(r"detail\s+(\S+)", q)
-        if m:
-            return {"name": "detail", "filters": {"property_id": m.group(1)}}
-        m = re.match(r"book\s+(\S+)", q)
-        if m:
-            return {"name": "book", "filters": {"property_id": m.group(1)}}
-        m = re.match(r"cancel\s+(\S+)", q)
-        if m:
-            return {"name": "cancel", "filters": {"booking_id": m.group(1)}}
-        # naive parse for search
-        filters = {}
-        b = re.search(r"(\d+)\s*(br|bed|beds|bd|bedroom|bedrooms)\b", q)
-        if b:
-            filters["bedrooms"] = int(b.group(1))
-        m = re.search(r"under\s+(\d+[\d,\s]*)", q)
-        if m:
-            filters["price_max"] = int(m.group(1).replace(",", "").replace(" ", ""))
-        m = re.search(r"under\s+(\d+)\s*k\b", q)
-        if m:
-            filters["price_max"] = int(m.group(1)) * 1000
-        m = re.search(r"over\s+(\d+[\d,]*)", q)
-        if m:
-            filters["price_min"] = int(m.group(1).replace(",", ""))
-        m = re.search(r"in\s+([a-z\-\s]+)$", q)
-        if m:
-            filters["neighborhood"] = m.group(1).strip()
-        if "condo" in q:
-            filters["property_type"] = "condo"
-        if "retail" in q:
-            filters["property_type"] = "retail"
-        if "land" in q:
-            filters["property_type"] = "land"
-        if filters:
-            return {"name": "search", "filters": filters}
-        return {"name": "fallback", "filters": {}}
-
+    def _regex_intent(self, text: str) -> Dict[str, Any]:
+        return regex_intent(text)
@@ -0,0 +1,202 @@
+# Rule-based intent parsing used before (or instead of) Gemini. No I/O or
+# third-party imports so it can be compiled with mypyc (see setup.py).
+import re
+from typing import Any, Dict, Iterable, Optional, Set
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Build a regex alternation from a word list via a character trie.
+
+    Shared prefixes are factored out ("condo|condominium" -> "condo(?:minium)?")
+    so the alternation stays linear in the total word length as the list grows.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        optional = "" in node
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if optional:
+            body = ("(?:" + body + ")" if len(branches) == 1 and len(body) > 1 else body) + "?"
+        return body
+
+    return emit(trie)
+
+
+# Later entries win when several appear in the same message
+_PROPERTY_TYPES = ("condo", "retail", "land")
+
+_RE_COMMAND = re.compile(
+    r"(?P<browse>browse)"
+    r"|(?P<my_bookings>my bookings)"
+    r"|detail\s+(?P<detail>\S+)"
+    r"|book\s+(?P<book>\S+)"
+    r"|cancel\s+(?P<cancel>\S+)"
+)
+
+# Bedroom unit words, longest first so "bedrooms" isn't read as "bed"
+_BEDROOM_UNITS = ("bedrooms", "bedroom", "beds", "bed", "br", "bd")
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _scan_numbers(q: str) -> Dict[str, Any]:
+    """Numeric search filters from one left-to-right pass over the digit runs in q.
+
+    Each run is classified by the keyword before it ("under"/"over") and the
+    word after it (a bedroom unit, or "k" for thousands). The first run of each
+    kind wins, and "under Nk" takes precedence over a plain "under N".
+    """
+    found: Dict[str, int] = {}
+    n = len(q)
+    i = 0
+    while i < n:
+        if not q[i].isdecimal():
+            i += 1
+            continue
+        start = i
+        while i < n and q[i].isdecimal():
+            i += 1
+        digits = q[start:i]
+        # keyword before the run ("under 20k", "over 1,000")
+        j = start
+        while j > 0 and q[j - 1].isspace():
+            j -= 1
+        keyword: Optional[str] = None
+        if j < start:
+            if q.endswith("under", 0, j):
+                keyword = "under"
+            elif q.endswith("over", 0, j):
+                keyword = "over"
+        # word after the run ("2 bed", "20k")
+        k = i
+        while k < n and q[k].isspace():
+            k += 1
+        if "bedrooms" not in found:
+            for unit in _BEDROOM_UNITS:
+                end = k + len(unit)
+                if q.startswith(unit, k) and (end == n or not _is_word_char(q[end])):
+                    found["bedrooms"] = int(digits)
+                    break
+        if keyword == "under":
+            if q.startswith("k", k) and (k + 1 == n or not _is_word_char(q[k + 1])):
+                found.setdefault("under_k", int(digits) * 1000)
+            elif "under" not in found:
+                end = i
+                while end < n and (q[end].isdecimal() or q[end] == "," or q[end].isspace()):
+                    end += 1
+                found["under"] = int(q[start:end].replace(",", "").replace(" ", ""))
+        elif keyword == "over" and "over" not in found:
+            end = i
+            while end < n and (q[end].isdecimal() or q[end] == ","):
+                end += 1
+            found["over"] = int(q[start:end].replace(",", ""))
+    filters: Dict[str, Any] = {}
+    if "bedrooms" in found:
+        filters["bedrooms"] = found["bedrooms"]
+    if "under_k" in found:
+        filters["price_max"] = found["under_k"]
+    elif "under" in found:
+        filters["price_max"] = found["under"]
+    if "over" in found:
+        filters["price_min"] = found["over"]
+    return filters
+
+
+# Area and property-type tokens in one scan. The alternation sits inside a
+# lookahead so tokens never consume each other's text.
+_RE_TOKENS = re.compile(
+    r"(?="
+    r"in\s+(?P<area>[a-z\-\s]+)$"
+    r"|(?P<type>" + _trie_pattern(_PROPERTY_TYPES) + r")"
+    r")"
+)
+
+
+def regex_intent(text: str) -> Dict[str, Any]:
+    q = text.lower().strip()
+    # normalize spaces
+    q = ' '.join(q.split())
+    m = _RE_COMMAND.match(q)
+    if m:
+        name = m.lastgroup or ""
+        if name in ("browse", "my_bookings"):
+            return {"name": name, "filters": {}}
+        key = "booking_id" if name == "cancel" else "property_id"
+        return {"name": name, "filters": {key: m.group(name)}}
+    # naive parse for search: first occurrence of each token wins
+    filters = _scan_numbers(q)
+    area: Optional[str] = None
+    types: Set[str] = set()
+    for m in _RE_TOKENS.finditer(q):
+        if m.lastgroup == "type":
+            types.add(m.group("type"))
+        elif area is None:
+            area = m.group("area")
+    if area is not None:
+        filters["neighborhood"] = area.strip()
+    for t in _PROPERTY_TYPES:
+        if t in types:
+            filters["property_type"] = t
+    if filters:
+        return {"name": "search", "filters": filters}
+    return {"name": "fallback", "filters": {}}
+
+
+# Words the regex parser understands; anything else is left to Gemini
+_KNOWN_WORDS = frozenset(
+    ["under", "over", "in", "k", "br", "bed", "beds", "bd", "bedroom", "bedrooms",
+     "a", "an", "the", "for", "show", "find", "me", "any", "baht", "thb"]
+    + list(_PROPERTY_TYPES)
+)
+_RE_NUMERIC_TOKEN = re.compile(r"[\d,]+k?|\d+(?:br|bed|beds|bd|bedroom|bedrooms)")
+# command intents and how many words their regex consumes
+_COMMAND_WORDS = {"browse": 1, "my_bookings": 2, "detail": 2, "book": 2, "cancel": 2}
+
+
+def needs_llm(user_text: str, intent: Dict[str, Any]) -> bool:
+    """Whether a regex-parsed intent is too uncertain to act on without Gemini."""
+    words = user_text.lower().split()
+    name = intent.get("name")
+    if name in _COMMAND_WORDS:
+        # trailing words ("browse condos in ari") would be silently ignored
+        return len(words) > _COMMAND_WORDS[name]
+    filters = intent.get("filters") or {}
+    if not filters or len(words) > 6:
+        return True
+    area_words = (filters.get("neighborhood") or "").split()
+    if len(area_words) > 3:
+        return True
+    for w in words:
+        if w in _KNOWN_WORDS or w in area_words or _RE_NUMERIC_TOKEN.fullmatch(w):
+            continue
+        return True
+    return False
+
+
+def refines_context(intent: Dict[str, Any], session_context: Optional[Dict[str, Any]]) -> bool:
+    """Whether a regex-parsed search may lean on the previous search's filters.
+
+    "under 20k" after "condo in ari" only names a price; the regex can't carry
+    the earlier area and type over, so such partial searches go to Gemini with
+    the session context. A search restating every earlier filter doesn't.
+    """
+    if intent.get("name") != "search" or not session_context:
+        return False
+    last = session_context.get("last_filters")
+    if not isinstance(last, dict):
+        return False
+    filters = intent.get("filters") or {}
+    for k, v in last.items():
+        if v is not None and v != "" and k not in filters:
+            return True
+    return False
@@ -1,15 +1,19 @@
 import os
 import sys
 import json
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.base import JobLookupError
 from datetime import datetime, timezone
-import tempfile
-import base64
 from fastapi.responses import JSONResponse
+import orjson
 
 from linebot.v3.webhook import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
@@ -29,21 +33,22 @@ from linebot.v3.messaging import (
     FlexMessage,
 )
 from linebot.v3.webhooks import (
+    Event,
     MessageEvent,
     PostbackEvent,
     TextMessageContent,
 )
 
 from repositories.properties_repo import PropertiesRepository
-from repositories.bookings_repo import BookingsRepository
+from repositories.bookings_repo import BookingsRepository, booking_start_ts
 from repositories.agents_repo import AgentsRepository
 from repositories.calendar_repo import CalendarRepository
 from repositories.sessions_repo import SessionsRepository
+from repositories.google_clients import get_calendar_service, get_gspread
 from flex_templates import (
     build_property_card,
     build_property_carousel,
     build_booking_confirmation_bubble,
-    build_pagination_bubble,
 )
 from gemini_client import GeminiNLU
 
@@ -52,24 +57,11 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("realestate-bot")
 
 
-# Allow service account JSON injection for serverless
-sa_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
-if not sa_json:
-    b64 = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON_B64')
-    if b64:
-        try:
-            sa_json = base64.b64decode(b64).decode()
-        except Exception:
-            sa_json = None
-if sa_json and not os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.json')
-    tmp.write(sa_json.encode()); tmp.flush(); tmp.close()
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = tmp.name
-
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
 channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 
 # Lazy-initialize LINE clients only when creds exist
+line_api_client = None
 line_bot_api = None
 parser = None
 
@@ -84,6 +76,10 @@ sessions_repo = None
 # NLU (lazy)
 gemini = None
 
+# Caps webhook events handled at once so bursts don't fan out unbounded
+# Gemini/Sheets/LINE calls
+_event_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_EVENTS", "32")))
+
 
 app = FastAPI()
 scheduler = None
@@ -99,10 +95,26 @@ def _safe_text(text: str) -> TextMessage:
     return TextMessage(text=text[:4900])
 
 
+# Fixed replies are built once instead of re-validating a TextMessage per reply
+_MSG_ERROR = _safe_text("Sorry, something went wrong. Please try again.")
+_MSG_GREETING = _safe_text("Hi! Try 'browse' or '2 bed in Ari under 60000' or 'book <id>'")
+_MSG_NO_RESULTS = _safe_text("No properties found. Try: 'browse' or '2 bed in Ari under 60000'")
+_MSG_PROPERTY_NOT_FOUND = _safe_text("Property not found.")
+_MSG_BOOK_WHICH = _safe_text("Please specify a valid property to book.")
+_MSG_NO_BOOKINGS = _safe_text("You have no bookings.")
+_MSG_CANCEL_WHICH = _safe_text("Please specify a booking id to cancel.")
+_MSG_HELP = _safe_text("Try: 'browse' or '2 bed in Ari under 60000' or 'book <id>' or 'my bookings'")
+_MSG_SLOT_TAKEN = _safe_text("Time slot already taken. Please choose another time.")
+_MSG_SLOT_TAKEN_CALENDAR = _safe_text("Time slot already taken (Calendar). Please choose another time.")
+_MSG_NO_MORE = _safe_text("No more results.")
+_MSG_CANCELLED = _safe_text("Cancelled.")
+_MSG_CANCEL_FAILED = _safe_text("Booking not found or already cancelled.")
+
+
 def ensure_context():
     """Lazily initialize external clients and repositories."""
-    global line_bot_api, parser
-    global properties_repo, bookings_repo, agents_repo, calendar_repo, gemini
+    global line_api_client, line_bot_api, parser
+    global properties_repo, bookings_repo, agents_repo, calendar_repo, sessions_repo, gemini
 
     # LINE
     if line_bot_api is None or parser is None:
@@ -110,8 +122,11 @@ def ensure_context():
         cat = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
         if cs and cat:
             configuration = Configuration(access_token=cat)
-            api_client = AsyncApiClient(configuration)
-            line_bot_api = AsyncMessagingApi(api_client)
+            # one aiohttp pool shared by replies, pushes and profile lookups;
+            # the SDK default (5 x CPUs) is small for bursts of concurrent events
+            configuration.connection_pool_maxsize = int(os.getenv("LINE_HTTP_LIMIT", "100"))
+            line_api_client = AsyncApiClient(configuration)
+            line_bot_api = AsyncMessagingApi(line_api_client)
             parser = WebhookParser(cs)
 
     # Google-backed repos
@@ -148,14 +163,50 @@ def ensure_context():
     # Gemini
     if gemini is None:
         try:
-            gemini_key = os.getenv("GEMINI_API_KEY")
-            if gemini_key:
-                gemini_local = GeminiNLU()
-                gemini = gemini_local
+            # Without GEMINI_API_KEY this runs in regex-only mode
+            gemini = GeminiNLU()
         except Exception:
             pass
 
 
+async def _warm_caches():
+    # Load the sheets and authorize the Google clients before the first
+    # webhook so it doesn't pay for them
+    repos = [r for r in (properties_repo, bookings_repo, agents_repo) if r is not None]
+    if not repos:
+        return
+    results = await asyncio.gather(
+        *(asyncio.to_thread(r._read_all) for r in repos),
+        asyncio.to_thread(get_calendar_service),
+        return_exceptions=True,
+    )
+    for r in results:
+        if isinstance(r, Exception):
+            logger.warning("Cache warm-up failed: %s", r)
+
+
+@app.on_event("startup")
+async def startup():
+    # Blocking Sheets/Calendar calls run on worker threads; size the pool for
+    # concurrent webhooks rather than the CPU-based default
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("REPO_THREADS", "16")))
+    )
+    ensure_context()
+    await _warm_caches()
+    if scheduler is not None and ENABLE_REMINDERS and bookings_repo is not None:
+        try:
+            await _schedule_pending_reminders()
+        except Exception as e:
+            logger.warning("Failed to schedule reminders: %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if gemini is not None:
+        await gemini.aclose()
+    if line_api_client is not None:
+        await line_api_client.close()
 
 
 @app.get("/callback")
@@ -168,7 +219,7 @@ async def callback_get():
 
 
 @app.post("/callback")
-async def callback(request: Request):
+async def callback(request: Request, background_tasks: BackgroundTasks):
     ensure_context()
     if not parser or not line_bot_api:
         raise HTTPException(status_code=500, detail="LINE credentials not configured")
@@ -186,7 +237,7 @@ async def callback(request: Request):
         logger.warning("LINE credentials not configured; skipping")
         return "OK"
     try:
-        events = parser.parse(body, signature)
+        events = _parse_webhook(body, signature)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
@@ -194,29 +245,53 @@ async def callback(request: Request):
         # Acknowledge to avoid LINE retry storms
         return "OK"
 
-    for event in events:
+    # Acknowledge right away: LINE redelivers events that take more than a
+    # couple of seconds, and reply tokens stay valid long enough for the work
+    # to finish after the response
+    background_tasks.add_task(_handle_events, events)
+    return "OK"
+
+
+def _parse_webhook(body: str, signature: str) -> list:
+    """WebhookParser.parse, with the body decoded by orjson instead of json.
+
+    Events of unknown type are dropped here; the handlers ignore them anyway.
+    """
+    if not parser.skip_signature_verification() and not parser.signature_validator.validate(body, signature):
+        raise InvalidSignatureError("Invalid signature. signature=" + signature)
+    events = []
+    for e in orjson.loads(body)["events"]:
+        try:
+            events.append(Event.from_dict(e))
+        except ValueError:
+            logger.info("Unknown event type: %s", e.get("type"))
+    return events
+
+
+async def _handle_events(events):
+    await asyncio.gather(*(_handle_event(event) for event in events))
+
+
+async def _handle_event(event):
+    async with _event_semaphore:
         try:
             if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
                 await _handle_text(event)
             elif isinstance(event, PostbackEvent):
                 await _handle_postback(event)
-            else:
-                # Ignore other events for now
-                continue
+            # Ignore other events for now
         except Exception as e:
             logger.exception("Callback handler error: %s", e)
             try:
                 await line_bot_api.reply_message(
                     ReplyMessageRequest(
                         reply_token=event.reply_token,
-                        messages=[_safe_text("Sorry, something went wrong. Please try again.")]
+                        messages=[_MSG_ERROR]
                     )
                 )
             except Exception:
                 pass
 
-    return "OK"
-
 
 async def _handle_text(event: MessageEvent):
     ensure_context()
@@ -225,7 +300,7 @@ async def _handle_text(event: MessageEvent):
 
     try:
         ensure_context()
-        ctx = sessions_repo.get_context(user_id) if sessions_repo else {}
+        ctx = await asyncio.to_thread(sessions_repo.get_context, user_id) if sessions_repo else {}
         intent = await gemini.parse_intent(user_text, ctx)
     except Exception as e:
         logger.exception("Gemini intent parsing failed: %s", e)
@@ -239,7 +314,7 @@ async def _handle_text(event: MessageEvent):
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[_safe_text("Hi! Try 'browse' or '2 bed in Ari under 60000' or 'book <id>'")]
+                messages=[_MSG_GREETING]
             )
         )
         return
@@ -252,22 +327,21 @@ async def _handle_text(event: MessageEvent):
                 cursor = max(0, int(filters["cursor"]))
         except Exception:
             cursor = 0
-        props = properties_repo.search(filters)
-        if not props:
+        page, has_more = await asyncio.to_thread(properties_repo.search, filters, cursor, 9)
+        if not page:
             await line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[_safe_text("No properties found. Try: 'browse' or '2 bed in Ari under 60000'")]
+                    messages=[_MSG_NO_RESULTS]
                 )
             )
             return
-        page = props[cursor:cursor + 9]
-        bubbles = [build_property_card(p) for p in page]
         # add next pager if there are more
-        if cursor + 9 < len(props):
+        next_data = None
+        if has_more:
             next_cursor = cursor + 9
-            bubbles.append(build_pagination_bubble("More results", f"action=browse&cursor={next_cursor}"))
-        car = build_property_carousel(bubbles)
+            next_data = f"action=browse&cursor={next_cursor}"
+        car = build_property_carousel(page, next_data)
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
@@ -281,17 +355,17 @@ async def _handle_text(event: MessageEvent):
                 'last_filters': filters,
                 'last_action': name,
             })
-            sessions_repo.set_context(user_id, new_ctx)
+            await asyncio.to_thread(sessions_repo.set_context, user_id, new_ctx)
         return
 
     if name == "detail":
         pid = filters.get("property_id")
-        prop = properties_repo.get_by_id(pid) if pid else None
+        prop = await asyncio.to_thread(properties_repo.get_by_id, pid) if pid else None
         if not prop:
             await line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[_safe_text("Property not found.")]
+                    messages=[_MSG_PROPERTY_NOT_FOUND]
                 )
             )
             return
@@ -306,12 +380,12 @@ async def _handle_text(event: MessageEvent):
 
     if name == "book":
         pid = filters.get("property_id")
-        prop = properties_repo.get_by_id(pid) if pid else None
+        prop = await asyncio.to_thread(properties_repo.get_by_id, pid) if pid else None
         if not prop:
             await line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[_safe_text("Please specify a valid property to book.")]
+                    messages=[_MSG_BOOK_WHICH]
                 )
             )
             return
@@ -338,18 +412,22 @@ async def _handle_text(event: MessageEvent):
         return
 
     if name == "my_bookings":
-        bookings = bookings_repo.list_for_user(user_id)
+        bookings = await asyncio.to_thread(bookings_repo.list_for_user, user_id)
         if not bookings:
             await line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[_safe_text("You have no bookings.")]
+                    messages=[_MSG_NO_BOOKINGS]
                 )
             )
             return
+        bookings = bookings[:10]
+        props_by_id = await asyncio.to_thread(
+            properties_repo.get_many, {b.get("property_id") for b in bookings}
+        )
         lines = []
-        for b in bookings[:10]:
-            prop = properties_repo.get_by_id(b.get("property_id"))
+        for b in bookings:
+            prop = props_by_id.get(str(b.get("property_id")))
             title = prop.get("title") if prop else b.get("property_id")
             lines.append(f"#{b.get('booking_id')} - {title} at {b.get('datetime')} [{b.get('status')}]")
         await line_bot_api.reply_message(
@@ -366,16 +444,18 @@ async def _handle_text(event: MessageEvent):
             await line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[_safe_text("Please specify a booking id to cancel.")]
+                    messages=[_MSG_CANCEL_WHICH]
                 )
             )
             return
-        ok = bookings_repo.cancel(bid)
-        msg = "Cancelled." if ok else "Booking not found or already cancelled."
+        ok = await asyncio.to_thread(bookings_repo.cancel, bid)
+        if ok:
+            _unschedule_reminders(bid)
+        msg = _MSG_CANCELLED if ok else _MSG_CANCEL_FAILED
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[_safe_text(msg)]
+                messages=[msg]
             )
         )
         return
@@ -384,250 +464,366 @@ async def _handle_text(event: MessageEvent):
     await line_bot_api.reply_message(
         ReplyMessageRequest(
             reply_token=event.reply_token,
-            messages=[_safe_text("Try: 'browse' or '2 bed in Ari under 60000' or 'book <id>' or 'my bookings'")]
+            messages=[_MSG_HELP]
         )
     )
 
 
-async def _handle_postback(event: PostbackEvent):
-    data = event.postback.data or ""
-    ensure_context()
-    params = getattr(event.postback, "params", None)
+def _calendar_conflict(calendar_id: Optional[str], pid: str, dt: str) -> bool:
+    return bool(calendar_id and calendar_repo.find_event(calendar_id, pid, dt))
 
-    # booking datetime chosen
-    if data.startswith("action=book_pick") and isinstance(params, dict) and params.get("datetime"):
-        pid = _extract_query_param(data, "pid")
-        dt = params.get("datetime")
-        user_id = getattr(getattr(event, "source", None), "user_id", None)
-        display_name = None
-        try:
-            display_name = None  # optional: call profile API if needed
-        except Exception:
-            display_name = None
 
-        prop = properties_repo.get_by_id(pid) if pid else None
-        if not prop:
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("Property not found.")]
-                )
-            )
-            return
+def _booking_calendar(bid: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    # both answered from the sheet caches, so one thread hop covers them
+    b = bookings_repo.find_by_id(bid)
+    pid = b.get('property_id')
+    return b, properties_repo.get_calendar_id(pid) if pid else None
 
-        # check availability: both Sheets and Calendar
-        if bookings_repo.exists(pid, dt):
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("Time slot already taken. Please choose another time.")]
-                )
-            )
-            return
-        calendar_id = properties_repo.get_calendar_id(pid)
-        if calendar_id and calendar_repo.find_event(calendar_id, pid, dt):
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("Time slot already taken (Calendar). Please choose another time.")]
-                )
-            )
-            return
 
-        # try to enrich with user display name
-        try:
-            if user_id:
-                profile = await line_bot_api.get_profile(user_id=user_id)
-                display_name = getattr(profile, "display_name", None) or display_name
-        except Exception:
-            pass
+# LINE display names by user id; names rarely change, so one profile lookup
+# per user per process is enough
+_display_names: "OrderedDict[str, str]" = OrderedDict()
+_DISPLAY_NAMES_MAX = 10000
 
-        booking = bookings_repo.create(
-            user_id=user_id,
-            user_display_name=display_name,
-            property_id=pid,
-            dt_iso=dt,
-            notes=None,
-        )
 
-        bubble = build_booking_confirmation_bubble(prop, booking)
+def _cached_display_name(user_id: str) -> Optional[str]:
+    name = _display_names.get(user_id)
+    if name is not None:
+        # LRU: keep active users' names, evict the longest unused
+        _display_names.move_to_end(user_id)
+    return name
+
+
+async def _fetch_display_name(user_id: str) -> Optional[str]:
+    try:
+        profile = await line_bot_api.get_profile(user_id=user_id)
+    except Exception:
+        return None
+    name = getattr(profile, "display_name", None)
+    if name:
+        _display_names[user_id] = name
+        if len(_display_names) > _DISPLAY_NAMES_MAX:
+            _display_names.popitem(last=False)
+    return name
+
+
+# booking datetime chosen
+async def _postback_book_pick(event: PostbackEvent, query: Dict[str, str]):
+    params = getattr(event.postback, "params", None)
+    if not (isinstance(params, dict) and params.get("datetime")):
+        # no datetime picked: prompt for one again
+        await _postback_book(event, query)
+        return
+    pid = query.get("pid")
+    dt = params.get("datetime")
+    user_id = getattr(getattr(event, "source", None), "user_id", None)
+    display_name = _cached_display_name(user_id) if user_id else None
+
+    prop = await asyncio.to_thread(properties_repo.get_by_id, pid) if pid else None
+    if not prop:
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[FlexMessage(alt_text="Booking confirmed", contents=bubble)]
+                messages=[_MSG_PROPERTY_NOT_FOUND]
             )
         )
-        # create Google Calendar event
-        try:
-            if calendar_id:
-                calendar_repo.create_booking_event(
-                    calendar_id=calendar_id,
-                    property_id=pid,
-                    title=prop.get('title', 'Viewing'),
-                    dt_iso=dt,
-                    user_display_name=display_name,
-                )
-        except Exception as e:
-            logger.warning("Failed to create calendar event: %s", e)
         return
 
-    # detail from flex button
-    if data.startswith("action=detail"):
-        pid = _extract_query_param(data, "pid")
-        prop = properties_repo.get_by_id(pid) if pid else None
-        if not prop:
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("Property not found.")]
-                )
-            )
-            return
-        bubble = build_property_card(prop, include_actions=True)
+    # check availability: both Sheets and Calendar, overlapping the two round-trips
+    calendar_id = properties_repo.calendar_id_for(prop)
+    sheets_conflict, calendar_conflict = await asyncio.gather(
+        asyncio.to_thread(bookings_repo.exists, pid, dt),
+        asyncio.to_thread(_calendar_conflict, calendar_id, pid, dt),
+    )
+    if sheets_conflict:
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[FlexMessage(alt_text="Property detail", contents=bubble)]
+                messages=[_MSG_SLOT_TAKEN]
             )
         )
         return
-
-    # initiate booking from flex button
-    if data.startswith("action=book"):
-        pid = _extract_query_param(data, "pid")
-        prop = properties_repo.get_by_id(pid) if pid else None
-        if not prop:
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("Property not found.")]
-                )
-            )
-            return
+    if calendar_conflict:
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[
-                    TextMessage(
-                        text=f"Pick a date/time for {prop.get('title', 'the property')}",
-                        quick_reply=QuickReply(items=[
-                            QuickReplyItem(
-                                action=DatetimePickerAction(
-                                    label="Pick date",
-                                    data=f"action=book_pick&pid={prop['id']}",
-                                    mode="datetime",
-                                )
-                            )
-                        ])
-                    )
-                ]
+                messages=[_MSG_SLOT_TAKEN_CALENDAR]
             )
         )
         return
 
-    # cancel from flex button
-    if data.startswith("action=cancel"):
-        bid = _extract_query_param(data, "bid")
-        # attempt to cancel Sheets and Calendar
-        ok = bookings_repo.cancel(bid) if bid else False
-        if bid:
-            b = bookings_repo.find_by_id(bid)
-            pid = b.get('property_id')
-            dt = b.get('datetime')
-            cid = properties_repo.get_calendar_id(pid) if pid else None
+    booking = await asyncio.to_thread(
+        bookings_repo.create,
+        user_id=user_id,
+        user_display_name=display_name,
+        property_id=pid,
+        dt_iso=dt,
+        notes=None,
+    )
+    _schedule_reminders(booking)
+
+    bubble = build_booking_confirmation_bubble(prop, booking)
+    await line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[FlexMessage(alt_text="Booking confirmed", contents=bubble)]
+        )
+    )
+    # the display name is cosmetic: resolve it after the reply, then backfill the row
+    if user_id and display_name is None:
+        display_name = await _fetch_display_name(user_id)
+        if display_name:
+            # writes go to the row the append reported, after checking it still
+            # holds this booking; a refused write only loses the cosmetic name
             try:
-                if cid and dt:
-                    ev_id = calendar_repo.find_event(cid, pid, dt)
-                    if ev_id:
-                        calendar_repo.delete_event(cid, ev_id)
+                stored = await asyncio.to_thread(bookings_repo.set_display_name, booking["booking_id"], display_name)
+                if not stored:
+                    logger.warning("Display name not stored for booking %s", booking["booking_id"])
             except Exception as e:
-                logger.warning("Failed to delete calendar event: %s", e)
-        msg = "Cancelled." if ok else "Booking not found or already cancelled."
+                logger.warning("Failed to store display name: %s", e)
+    # create Google Calendar event
+    try:
+        if calendar_id:
+            await asyncio.to_thread(
+                calendar_repo.create_booking_event,
+                calendar_id=calendar_id,
+                property_id=pid,
+                title=prop.get('title', 'Viewing'),
+                dt_iso=dt,
+                user_display_name=display_name,
+            )
+    except Exception as e:
+        logger.warning("Failed to create calendar event: %s", e)
+
+
+# detail from flex button
+async def _postback_detail(event: PostbackEvent, query: Dict[str, str]):
+    pid = query.get("pid")
+    prop = await asyncio.to_thread(properties_repo.get_by_id, pid) if pid else None
+    if not prop:
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[_safe_text(msg)]
+                messages=[_MSG_PROPERTY_NOT_FOUND]
             )
         )
         return
+    bubble = build_property_card(prop, include_actions=True)
+    await line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[FlexMessage(alt_text="Property detail", contents=bubble)]
+        )
+    )
 
-    # browse pagination from flex button
-    if data.startswith("action=browse"):
-        cursor_str = _extract_query_param(data, "cursor") or "0"
-        try:
-            cursor = max(0, int(cursor_str))
-        except Exception:
-            cursor = 0
-        props = properties_repo.search({})
-        page = props[cursor:cursor + 9]
-        if not page:
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[_safe_text("No more results.")]
-                )
-            )
-            return
-        bubbles = [build_property_card(p) for p in page]
-        if cursor + 9 < len(props):
-            next_cursor = cursor + 9
-            bubbles.append(build_pagination_bubble("More results", f"action=browse&cursor={next_cursor}"))
-        car = build_property_carousel(bubbles)
+
+# initiate booking from flex button
+async def _postback_book(event: PostbackEvent, query: Dict[str, str]):
+    pid = query.get("pid")
+    prop = await asyncio.to_thread(properties_repo.get_by_id, pid) if pid else None
+    if not prop:
         await line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[FlexMessage(alt_text="More properties", contents=car)]
+                messages=[_MSG_PROPERTY_NOT_FOUND]
             )
         )
         return
+    await line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[
+                TextMessage(
+                    text=f"Pick a date/time for {prop.get('title', 'the property')}",
+                    quick_reply=QuickReply(items=[
+                        QuickReplyItem(
+                            action=DatetimePickerAction(
+                                label="Pick date",
+                                data=f"action=book_pick&pid={prop['id']}",
+                                mode="datetime",
+                            )
+                        )
+                    ])
+                )
+            ]
+        )
+    )
+
+
+# cancel from flex button
+async def _postback_cancel(event: PostbackEvent, query: Dict[str, str]):
+    bid = query.get("bid")
+    # attempt to cancel Sheets and Calendar; the calendar lookup only needs the
+    # booking's property and time, so it runs alongside the cancel write
+    ok = False
+    if bid:
+        ok, (b, cid) = await asyncio.gather(
+            asyncio.to_thread(bookings_repo.cancel, bid),
+            asyncio.to_thread(_booking_calendar, bid),
+        )
+        if ok and not b:
+            # booked elsewhere: cancel() has reloaded the sheet by now
+            b, cid = await asyncio.to_thread(_booking_calendar, bid)
+    if ok:
+        _unschedule_reminders(bid)
+    if bid:
+        pid = b.get('property_id')
+        dt = b.get('datetime')
+        try:
+            if cid and dt:
+                ev_id = await asyncio.to_thread(calendar_repo.find_event, cid, pid, dt)
+                if ev_id:
+                    await asyncio.to_thread(calendar_repo.delete_event, cid, ev_id)
+        except Exception as e:
+            logger.warning("Failed to delete calendar event: %s", e)
+    msg = _MSG_CANCELLED if ok else _MSG_CANCEL_FAILED
+    await line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[msg]
+        )
+    )
 
 
-def _extract_query_param(data: str, key: str) -> Optional[str]:
+# browse pagination from flex button
+async def _postback_browse(event: PostbackEvent, query: Dict[str, str]):
+    cursor_str = query.get("cursor") or "0"
     try:
-        parts = data.split("&")
-        for p in parts:
-            if p.startswith(f"{key}="):
-                return p.split("=", 1)[1]
+        cursor = max(0, int(cursor_str))
     except Exception:
-        return None
-    return None
+        cursor = 0
+    page, has_more = await asyncio.to_thread(properties_repo.search, {}, cursor, 9)
+    if not page:
+        await line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[_MSG_NO_MORE]
+            )
+        )
+        return
+    next_data = None
+    if has_more:
+        next_cursor = cursor + 9
+        next_data = f"action=browse&cursor={next_cursor}"
+    car = build_property_carousel(page, next_data)
+    await line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[FlexMessage(alt_text="More properties", contents=car)]
+        )
+    )
+
+
+_POSTBACK_ACTIONS = {
+    "book_pick": _postback_book_pick,
+    "detail": _postback_detail,
+    "book": _postback_book,
+    "cancel": _postback_cancel,
+    "browse": _postback_browse,
+}
+
+
+async def _handle_postback(event: PostbackEvent):
+    data = event.postback.data or ""
+    ensure_context()
+    # postback data is a query string; parse it once and dispatch on its action
+    query = dict(parse_qsl(data))
+    handler = _POSTBACK_ACTIONS.get(query.get("action", ""))
+    if handler is not None:
+        await handler(event, query)
+
+
+# Reminders at T-24h and T-2h: one-shot scheduler jobs per booking, plus
+# /cron/reminders for platforms without a background scheduler
+ENABLE_REMINDERS = int(os.getenv('ENABLE_REMINDERS', '1')) == 1
+_REMINDER_WINDOWS = (('2h', 2*3600), ('24h', 24*3600))
+# half-width of each cron window; covers a 10 minute cron interval
+_REMINDER_SLACK = 5*60
+# (booking_id, window) pairs already pushed by this process -> booking start;
+# entries are dropped once the viewing has started, as no window can recur
+_reminders_sent: Dict[Tuple[str, str], float] = {}
+
+
+def _schedule_reminders(booking: Dict[str, Any]):
+    if scheduler is None or not ENABLE_REMINDERS:
+        return
+    start = booking_start_ts(booking)
+    if start is None:
+        return
+    now = datetime.now(timezone.utc).timestamp()
+    bid = str(booking.get('booking_id'))
+    for window, offset in _REMINDER_WINDOWS:
+        fire = start - offset
+        if fire <= now:
+            continue
+        scheduler.add_job(
+            _reminder_job,
+            'date',
+            run_date=datetime.fromtimestamp(fire, timezone.utc),
+            args=[bid, window],
+            id=f'{bid}-{window}',
+            replace_existing=True,
+            misfire_grace_time=_REMINDER_SLACK,
+        )
+
+
+def _unschedule_reminders(booking_id: str):
+    if scheduler is None:
+        return
+    for window, _ in _REMINDER_WINDOWS:
+        try:
+            scheduler.remove_job(f'{booking_id}-{window}')
+        except JobLookupError:
+            pass
+
+
+async def _schedule_pending_reminders():
+    now = datetime.now(timezone.utc).timestamp()
+    upcoming = await asyncio.to_thread(bookings_repo.active_starting_between, now, float('inf'))
+    for b in upcoming:
+        _schedule_reminders(b)
+
+
+async def _reminder_job(booking_id: str, window: str):
+    if not line_bot_api:
+        return
+    # re-read: another instance may have cancelled it since it was scheduled
+    b = await asyncio.to_thread(bookings_repo.find_by_id, booking_id)
+    if b and str(b.get('status', 'requested')).lower() in ('requested', 'confirmed'):
+        await _remind_once(b, window)
+
+
+async def _remind_once(booking: Dict[str, Any], window: str):
+    key = (str(booking.get('booking_id')), window)
+    if key in _reminders_sent:
+        return
+    now = datetime.now(timezone.utc).timestamp()
+    for k in [k for k, start in _reminders_sent.items() if start < now]:
+        del _reminders_sent[k]
+    start = booking_start_ts(booking)
+    _reminders_sent[key] = start if start is not None else now + _REMINDER_WINDOWS[-1][1]
+    await _push_reminder(booking, window)
 
 
-# simple reminder job (T-24h and T-2h) running every 10 minutes
 async def send_reminders():
     if not line_bot_api:
         logger.warning('Reminders skipped: LINE credentials not configured')
         return
+    if not ENABLE_REMINDERS:
+        return
     try:
-        now = datetime.now(timezone.utc)
-        upcoming = bookings_repo._read_all()
-        for b in upcoming:
-            status = str(b.get('status', 'requested')).lower()
-            if status not in ('requested', 'confirmed'):
-                continue
-            dt_iso = b.get('datetime')
-            try:
-                dt = datetime.fromisoformat((dt_iso or '').replace('Z', '+00:00'))
-            except Exception:
-                continue
-            delta = (dt - now).total_seconds()
-            # within ~2h or ~24h windows (±5min)
-            if (2*3600 - 5*60) < delta < (2*3600 + 5*60) and int(os.getenv('ENABLE_REMINDERS', '1')) == 1:
-                await _push_reminder(b, '2h')
-            if (24*3600 - 5*60) < delta < (24*3600 + 5*60) and int(os.getenv('ENABLE_REMINDERS', '1')) == 1:
-                await _push_reminder(b, '24h')
+        now = datetime.now(timezone.utc).timestamp()
+        for window, offset in _REMINDER_WINDOWS:
+            target = now + offset
+            due = await asyncio.to_thread(
+                bookings_repo.active_starting_between, target - _REMINDER_SLACK, target + _REMINDER_SLACK
+            )
+            for b in due:
+                await _remind_once(b, window)
     except Exception as e:
         logger.warning('Reminder job failed: %s', e)
 
 
-# If scheduler exists, register the job
-if scheduler is not None:
-    try:
-        scheduler.add_job(send_reminders, 'interval', minutes=10)
-    except Exception as e:
-        logger.warning("Failed to add reminder job: %s", e)
-
-
 # Optional HTTP trigger for reminders (for platforms like Vercel/cron)
 @app.get('/cron/reminders')
 async def cron_reminders():
@@ -639,7 +835,7 @@ async def _push_reminder(booking: Dict[str, Any], window: str):
     try:
         user_id = booking.get('user_id')
         pid = booking.get('property_id')
-        prop = properties_repo.get_by_id(pid)
+        prop = await asyncio.to_thread(properties_repo.get_by_id, pid)
         title = prop.get('title') if prop else pid
         dt_str = booking.get('datetime')
         msg = f"Reminder: Viewing for {title} at {dt_str} (T-{window})."
@@ -662,7 +858,11 @@ async def healthz():
             'LINE_CHANNEL_SECRET': bool(os.getenv('LINE_CHANNEL_SECRET')),
             'LINE_CHANNEL_ACCESS_TOKEN': bool(os.getenv('LINE_CHANNEL_ACCESS_TOKEN')),
             'GEMINI_API_KEY': bool(os.getenv('GEMINI_API_KEY')),
-            'GOOGLE_SERVICE_ACCOUNT_JSON_or_FILE': bool(os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON') or os.getenv('GOOGLE_APPLICATION_CREDENTIALS')),
+            'GOOGLE_SERVICE_ACCOUNT_JSON_or_FILE': bool(
+                os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
+                or os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON_B64')
+                or os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+            ),
             'GOOGLE_SHEETS_DOCUMENT_ID': bool(os.getenv('GOOGLE_SHEETS_DOCUMENT_ID')),
             'DEFAULT_GOOGLE_CALENDAR_ID': bool(os.getenv('DEFAULT_GOOGLE_CALENDAR_ID')),
         },
@@ -672,28 +872,14 @@ async def healthz():
     # Sheets check
     try:
         ensure_context()
-        from google.oauth2.service_account import Credentials  # type: ignore
-        import gspread  # type: ignore
-        if os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON') and not os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
-            # already written to temp at startup
-            pass
-        cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        creds = Credentials.from_service_account_file(cred_path, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        gc = gspread.authorize(creds)
         sid = os.getenv('GOOGLE_SHEETS_DOCUMENT_ID')
-        sh = gc.open_by_key(sid)
-        _ = sh.title
+        await asyncio.to_thread(lambda: get_gspread().open_by_key(sid).title)
         status['sheets']['ok'] = True
     except Exception as e:
         status['sheets']['error'] = str(e)
     # Calendar check
     try:
-        from google.oauth2.service_account import Credentials  # type: ignore
-        from googleapiclient.discovery import build  # type: ignore
-        cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        creds = Credentials.from_service_account_file(cred_path, scopes=['https://www.googleapis.com/auth/calendar.readonly'])
-        svc = build('calendar', 'v3', credentials=creds, cache_discovery=False)
-        resp = svc.calendarList().list(maxResults=1).execute()
+        await asyncio.to_thread(lambda: get_calendar_service().calendarList().list(maxResults=1).execute())
         status['calendar']['ok'] = True
     except Exception as e:
         status['calendar']['error'] = str(e)
@@ -1,14 +1,8 @@
 import os
-import time
 from typing import Dict, Any, Optional
 
-import gspread
-from google.oauth2.service_account import Credentials
-
-
-_SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-]
+from .google_clients import get_gspread, get_spreadsheet_version
+from .sheet_cache import CachedSheet, sheet_cache
 
 
 class AgentsRepository:
@@ -16,31 +10,39 @@ class AgentsRepository:
         self.sheet_id = os.getenv("GOOGLE_SHEETS_DOCUMENT_ID")
         if not self.sheet_id:
             raise RuntimeError("GOOGLE_SHEETS_DOCUMENT_ID is required")
-        self._cache = None
-        self._cache_ts = 0.0
+        self._cache_key = f"{self.sheet_id}:agents"
         self._cache_ttl = 60.0
-
-    def _client(self):
-        creds = Credentials.from_service_account_file(
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"], scopes=_SCOPES
-        )
-        return gspread.authorize(creds)
+        self._ws = None
+
+    def _worksheet(self):
+        if self._ws is None:
+            gc = get_gspread()
+            sh = gc.open_by_key(self.sheet_id)
+            self._ws = sh.worksheet("agents")
+        return self._ws
+
+    def _load(self) -> CachedSheet:
+        try:
+            version: Optional[str] = self._version()
+        except Exception:
+            version = None
+        rows = self._worksheet().get_all_records()
+        # first row wins, matching the old linear scan
+        by_id: Dict[str, Dict[str, Any]] = {}
+        for r in rows:
+            by_id.setdefault(str(r.get("agent_id")), r)
+        return CachedSheet(rows, {"by_agent_id": by_id}, version)
+
+    def _version(self) -> str:
+        return get_spreadsheet_version(self.sheet_id)
+
+    def _sheet(self) -> CachedSheet:
+        return sheet_cache.get(self._cache_key, self._cache_ttl, self._load, self._version)
 
     def _read_all(self):
-        now = time.time()
-        if self._cache is not None and now - self._cache_ts < self._cache_ttl:
-            return self._cache
-        gc = self._client()
-        sh = gc.open_by_key(self.sheet_id)
-        ws = sh.worksheet("agents")
-        rows = ws.get_all_records()
-        self._cache = rows
-        self._cache_ts = now
-        return rows
+        return self._sheet().rows
 
     def get_by_id(self, agent_id: str) -> Optional[Dict[str, Any]]:
-        for r in self._read_all():
-            if str(r.get("agent_id")) == str(agent_id):
-                return r
-        return None
+        sheet = self._sheet()
+        return sheet.indexes["by_agent_id"].get(str(agent_id))
 
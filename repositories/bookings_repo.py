@@ -1,15 +1,43 @@
 import os
 import time
 import uuid
-from typing import List, Dict, Any
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from zoneinfo import ZoneInfo
 
-import gspread
-from google.oauth2.service_account import Credentials
+from gspread.utils import numericise, numericise_all, rowcol_to_a1
 
+from .google_clients import get_gspread, get_spreadsheet_version
+from .sheet_cache import CachedSheet, appended_row, sheet_cache
 
-_SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-]
+
+_ACTIVE_STATUSES = ("requested", "confirmed")
+# LINE's datetime picker sends local times with no offset; calendar events are
+# created in this zone too (CalendarRepository.create_booking_event)
+_BOOKING_TZ = ZoneInfo("Asia/Bangkok")
+
+
+def booking_start_ts(r: Dict[str, Any]) -> Optional[float]:
+    try:
+        dt = datetime.fromisoformat(str(r.get("datetime") or "").replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_BOOKING_TZ)
+    return dt.timestamp()
+
+
+def _index_row(indexes: Dict[str, Any], r: Dict[str, Any], row_num: Optional[int]):
+    bid = str(r.get("booking_id"))
+    if bid not in indexes["by_booking_id"]:
+        indexes["by_booking_id"][bid] = r
+        # unknown row numbers stay unset; _set_field reloads before writing
+        if row_num is not None:
+            indexes["row_num"][bid] = row_num
+    indexes["by_user_id"][str(r.get("user_id"))].append(r)
+    indexes["by_pid_dt"][(str(r.get("property_id")), str(r.get("datetime")))].append(r)
 
 
 class BookingsRepository:
@@ -17,36 +45,93 @@ class BookingsRepository:
         self.sheet_id = os.getenv("GOOGLE_SHEETS_DOCUMENT_ID")
         if not self.sheet_id:
             raise RuntimeError("GOOGLE_SHEETS_DOCUMENT_ID is required")
-        self._cache = None
-        self._cache_ts = 0.0
+        self._cache_key = f"{self.sheet_id}:bookings"
         self._cache_ttl = 15.0
+        self._ws = None
+
+    def _worksheet(self):
+        # the handle is only a (spreadsheet, sheet id) reference; opening it
+        # costs two metadata round-trips, so do that once
+        if self._ws is None:
+            gc = get_gspread()
+            sh = gc.open_by_key(self.sheet_id)
+            self._ws = sh.worksheet("bookings")
+        return self._ws
 
-    def _client(self):
-        creds = Credentials.from_service_account_file(
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"], scopes=_SCOPES
+    def _load(self) -> CachedSheet:
+        # same records as get_all_records(), but keeps the header row so writes
+        # can address cells without re-reading it
+        # read the revision first: an edit landing mid-read then fails revalidation
+        try:
+            version: Optional[str] = self._version()
+        except Exception:
+            # e.g. Drive API not enabled: fall back to plain TTL refreshes
+            version = None
+        values = self._worksheet().get(pad_values=True)
+        headers = values[0] if values and values[0] else []
+        rows = [dict(zip(headers, numericise_all(v))) for v in values[1:]] if headers else []
+        indexes: Dict[str, Any] = {
+            "headers": headers,
+            "col": {h: i + 1 for i, h in enumerate(headers)},
+            "by_booking_id": {},
+            "row_num": {},
+            "by_user_id": defaultdict(list),
+            "by_pid_dt": defaultdict(list),
+        }
+        # sheet row numbers are offset by the header row
+        for row_num, r in enumerate(rows, start=2):
+            _index_row(indexes, r, row_num)
+        # bookings ordered by start time, for reminder windows
+        starts = sorted(
+            ((ts, i) for i, ts in enumerate(map(booking_start_ts, rows)) if ts is not None)
         )
-        return gspread.authorize(creds)
+        indexes["start_ts"] = [ts for ts, _ in starts]
+        indexes["start_rows"] = [rows[i] for _, i in starts]
+        return CachedSheet(rows, indexes, version)
 
-    def _worksheet(self):
-        gc = self._client()
-        sh = gc.open_by_key(self.sheet_id)
-        return sh.worksheet("bookings")
+    def _version(self) -> str:
+        return get_spreadsheet_version(self.sheet_id)
+
+    def _sheet(self) -> CachedSheet:
+        return sheet_cache.get(self._cache_key, self._cache_ttl, self._load, self._version)
 
     def _read_all(self) -> List[Dict[str, Any]]:
-        now = time.time()
-        if self._cache is not None and now - self._cache_ts < self._cache_ttl:
-            return self._cache
-        ws = self._worksheet()
-        rows = ws.get_all_records()
-        self._cache = rows
-        self._cache_ts = now
-        return rows
+        return self._sheet().rows
 
     def exists(self, property_id: str, dt_iso: str) -> bool:
-        for r in self._read_all():
-            if str(r.get("property_id")) == str(property_id) and str(r.get("datetime")) == str(dt_iso):
-                if str(r.get("status", "requested")).lower() in ("requested", "confirmed"):
-                    return True
+        key = (str(property_id), str(dt_iso))
+        sheet = sheet_cache.fresh(self._cache_key, self._cache_ttl, self._version)
+        if sheet is None:
+            stale = sheet_cache.peek(self._cache_key)
+            if stale is not None and "property_id" in stale.indexes["col"] and "datetime" in stale.indexes["col"]:
+                return self._exists_remote(key, stale.indexes["col"])
+            sheet = self._sheet()
+        # .get: don't grow the defaultdict on misses
+        for r in sheet.indexes["by_pid_dt"].get(key, ()):
+            if str(r.get("status", "requested")).lower() in _ACTIVE_STATUSES:
+                return True
+        return False
+
+    def _exists_remote(self, key, col: Dict[str, int]) -> bool:
+        # Expired cache: fetch only the three columns the check needs (header
+        # positions from the last full load) instead of the whole table
+        names = ["property_id", "datetime"] + (["status"] if "status" in col else [])
+        ranges = []
+        for h in names:
+            letter = rowcol_to_a1(1, col[h])[:-1]
+            ranges.append(f"{letter}2:{letter}")
+        cols = self._worksheet().batch_get(ranges)
+        pids, dts = cols[0], cols[1]
+        statuses = cols[2] if len(cols) > 2 else []
+        for i, (pid_cell, dt_cell) in enumerate(zip(pids, dts)):
+            # match get_all_records() typing so "01" compares like the cache does
+            pid = str(numericise(pid_cell[0])) if pid_cell else ""
+            dt = str(numericise(dt_cell[0])) if dt_cell else ""
+            if (pid, dt) != key:
+                continue
+            status = statuses[i][0] if i < len(statuses) and statuses[i] else "requested"
+            if str(status).lower() in _ACTIVE_STATUSES:
+                return True
         return False
 
     def create(self, user_id: str, user_display_name: str, property_id: str, dt_iso: str, notes: str) -> Dict[str, Any]:
@@ -62,40 +147,66 @@ class BookingsRepository:
             "notes": notes or "",
         }
         ws = self._worksheet()
-        headers = ws.row_values(1)
-        ws.append_row([row.get(h, "") for h in headers])
-        # bust cache
-        self._cache = None
+        cached = sheet_cache.peek(self._cache_key)
+        headers = cached.indexes["headers"] if cached is not None and cached.indexes["headers"] else ws.row_values(1)
+        res = ws.append_row([row.get(h, "") for h in headers])
+        # keep the cache warm: index the new row instead of dropping the sheet.
+        # The row number comes from the append itself: concurrent creates or
+        # other instances make len(rows) + 1 a guess.
+        if cached is not None:
+            cached.rows.append(row)
+            _index_row(cached.indexes, row, appended_row(res))
+            ts = booking_start_ts(row)
+            if ts is not None:
+                pos = bisect_right(cached.indexes["start_ts"], ts)
+                cached.indexes["start_ts"].insert(pos, ts)
+                cached.indexes["start_rows"].insert(pos, row)
         return row
 
+    def active_starting_between(self, lo_ts: float, hi_ts: float) -> List[Dict[str, Any]]:
+        """Active bookings whose start time lies strictly between two epoch timestamps."""
+        indexes = self._sheet().indexes
+        start_ts = indexes["start_ts"]
+        i = bisect_right(start_ts, lo_ts)
+        j = bisect_left(start_ts, hi_ts)
+        return [
+            r for r in indexes["start_rows"][i:j]
+            if str(r.get("status", "requested")).lower() in _ACTIVE_STATUSES
+        ]
+
     def list_for_user(self, user_id: str) -> List[Dict[str, Any]]:
-        return [r for r in self._read_all() if str(r.get("user_id")) == str(user_id)]
+        return list(self._sheet().indexes["by_user_id"].get(str(user_id), ()))
 
-    def cancel(self, booking_id: str) -> bool:
-        ws = self._worksheet()
-        data = ws.get_all_records()
-        headers = ws.row_values(1)
-        id_idx = headers.index("booking_id") if "booking_id" in headers else None
-        status_idx = headers.index("status") if "status" in headers else None
-        # get additional fields for calendar sync
-        pid_idx = headers.index("property_id") if "property_id" in headers else None
-        dt_idx = headers.index("datetime") if "datetime" in headers else None
-        if id_idx is None or status_idx is None:
+    def _set_field(self, booking_id: str, field: str, value: Any) -> bool:
+        # one cell write addressed through the cached row number and header map
+        bid = str(booking_id)
+        sheet = self._sheet()
+        if bid not in sheet.indexes["row_num"]:
+            # may have been booked by another instance since the last load, or
+            # appended here without a known row number
+            sheet_cache.invalidate(self._cache_key)
+            sheet = self._sheet()
+        r = sheet.indexes["by_booking_id"].get(bid)
+        col = sheet.indexes["col"].get(field)
+        row_num = sheet.indexes["row_num"].get(bid)
+        if r is None or col is None or row_num is None:
             return False
-        # find row number (offset by header row)
-        row_num = 2
-        for r in data:
-            if str(r.get("booking_id")) == str(booking_id):
-                # write status to 'cancelled'
-                ws.update_cell(row_num, status_idx + 1, "cancelled")
-                self._cache = None
-                return True
-            row_num += 1
-        return False
+        # row numbers come from a full read or from the append response, never
+        # a guess; a hand edit that shifts rows changes the spreadsheet version,
+        # so the next expired read reloads instead of trusting them
+        self._worksheet().batch_update(
+            [{"range": rowcol_to_a1(row_num, col), "values": [[value]]}]
+        )
+        # rows are shared by every index, so one update covers them all
+        r[field] = value
+        return True
+
+    def cancel(self, booking_id: str) -> bool:
+        return self._set_field(booking_id, "status", "cancelled")
+
+    def set_display_name(self, booking_id: str, user_display_name: str) -> bool:
+        return self._set_field(booking_id, "user_display_name", user_display_name)
 
     def find_by_id(self, booking_id: str) -> Dict[str, Any]:
-        for r in self._read_all():
-            if str(r.get("booking_id")) == str(booking_id):
-                return r
-        return {}
+        return self._sheet().indexes["by_booking_id"].get(str(booking_id), {})
 
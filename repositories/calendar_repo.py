@@ -1,35 +1,63 @@
-import os
+from functools import lru_cache
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from dateutil import parser as date_parser
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 
+from .google_clients import get_calendar_service
 
-_SCOPES = [
-    'https://www.googleapis.com/auth/calendar',
-]
 
+@lru_cache(maxsize=None)
+def _zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return ZoneInfo('UTC')
+
+
+def _parse_dt(dt_iso: str) -> datetime:
+    # LINE's datetime picker sends plain ISO 8601; dateutil only for anything else
+    try:
+        return datetime.fromisoformat(dt_iso)
+    except ValueError:
+        return date_parser.parse(dt_iso)
 
-class CalendarRepository:
-    def __init__(self):
-        self._creds = None
 
+class CalendarRepository:
     def _client(self):
-        if not self._creds:
-            self._creds = Credentials.from_service_account_file(
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'], scopes=_SCOPES
-            )
-        return build('calendar', 'v3', credentials=self._creds, cache_discovery=False)
+        return get_calendar_service()
 
     def find_event(self, calendar_id: str, property_id: str, dt_iso: str) -> Optional[str]:
         svc = self._client()
-        q = f"pid:{property_id} dt:{dt_iso}"
-        events = svc.events().list(calendarId=calendar_id, q=q).execute()
-        for e in events.get('items', []):
-            return e.get('id')
+        events = svc.events()
+        results: Dict[str, Any] = {}
+        errors: list = []
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            else:
+                errors.append(exception)
+
+        # exact match on the private properties set by create_booking_event,
+        # plus the old description search for events created before those
+        # existed; both go out in one batch round-trip
+        batch = svc.new_batch_http_request(callback=collect)
+        batch.add(events.list(
+            calendarId=calendar_id,
+            privateExtendedProperty=[f"pid={property_id}", f"dt_iso={dt_iso}"],
+            maxResults=1,
+            singleEvents=True,
+        ), request_id='tagged')
+        batch.add(events.list(calendarId=calendar_id, q=f"pid:{property_id} dt:{dt_iso}"), request_id='legacy')
+        batch.execute()
+        if errors and not results:
+            # neither lookup answered; don't report the slot as free
+            raise errors[0]
+        for request_id in ('tagged', 'legacy'):
+            for e in results.get(request_id, {}).get('items', []):
+                return e.get('id')
         return None
 
     def create_booking_event(self, calendar_id: str, property_id: str, title: str, dt_iso: str, user_display_name: Optional[str], duration_minutes: int = 30, timezone: str = 'Asia/Bangkok') -> Optional[str]:
@@ -37,19 +65,16 @@ class CalendarRepository:
         summary = f"Viewing: {title}"
         description = f"pid:{property_id} dt:{dt_iso}\nBooked by: {user_display_name or ''}"
         # Parse start time and compute end time
-        try:
-            tz = ZoneInfo(timezone)
-        except Exception:
-            tz = ZoneInfo('UTC')
-        start_dt = date_parser.parse(dt_iso)
+        start_dt = _parse_dt(dt_iso)
         if start_dt.tzinfo is None:
-            start_dt = start_dt.replace(tzinfo=tz)
+            start_dt = start_dt.replace(tzinfo=_zone(timezone))
         end_dt = start_dt + timedelta(minutes=duration_minutes)
         event = {
             'summary': summary,
             'description': description,
             'start': {'dateTime': start_dt.isoformat(), 'timeZone': timezone},
             'end': {'dateTime': end_dt.isoformat(), 'timeZone': timezone},
+            'extendedProperties': {'private': {'pid': str(property_id), 'dt_iso': str(dt_iso)}},
         }
         created = svc.events().insert(calendarId=calendar_id, body=event).execute()
         return created.get('id')
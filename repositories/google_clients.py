@@ -0,0 +1,88 @@
+import base64
+import json
+import os
+import threading
+from functools import lru_cache
+
+import gspread
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from googleapiclient.discovery import build
+from gspread.urls import DRIVE_FILES_API_V3_URL
+
+
+_SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.readonly",
+]
+_CALENDAR_SCOPES = [
+    "https://www.googleapis.com/auth/calendar",
+]
+
+
+@lru_cache(maxsize=1)
+def service_account_info() -> dict:
+    """Service-account key, parsed once per process.
+
+    GOOGLE_APPLICATION_CREDENTIALS (a key file) wins; otherwise the key comes
+    from GOOGLE_SERVICE_ACCOUNT_JSON or GOOGLE_SERVICE_ACCOUNT_JSON_B64, which
+    serverless deployments use instead of a file.
+    """
+    path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    sa_json = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
+    if not sa_json:
+        b64 = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON_B64")
+        if not b64:
+            raise RuntimeError("Google service account credentials are not configured")
+        sa_json = base64.b64decode(b64).decode()
+    return json.loads(sa_json)
+
+
+@lru_cache(maxsize=1)
+def get_gspread() -> gspread.Client:
+    """Process-wide gspread client; credentials are loaded and authorized once."""
+    creds = Credentials.from_service_account_info(service_account_info(), scopes=_SHEETS_SCOPES)
+    gc = gspread.authorize(creds)
+    # keep a connection per worker thread alive instead of requests' default
+    # of 10, so concurrent repo calls don't fall back to fresh TLS handshakes
+    pool = int(os.getenv("REPO_THREADS", "16"))
+    gc.http_client.session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=pool))
+    return gc
+
+
+def get_spreadsheet_version(sheet_id: str) -> str:
+    """Drive revision counter of a spreadsheet; it changes on any edit to any tab.
+
+    The Sheets API has no conditional (ETag) reads, so this small metadata
+    request stands in for one when revalidating cached worksheets.
+    """
+    res = get_gspread().http_client.request(
+        "get",
+        f"{DRIVE_FILES_API_V3_URL}/{sheet_id}",
+        params={"fields": "version", "supportsAllDrives": True},
+    )
+    return str(res.json()["version"])
+
+
+@lru_cache(maxsize=1)
+def _calendar_credentials() -> Credentials:
+    return Credentials.from_service_account_info(service_account_info(), scopes=_CALENDAR_SCOPES)
+
+
+_calendar_local = threading.local()
+
+
+def get_calendar_service():
+    """Calendar API service sharing one set of credentials.
+
+    httplib2 connections aren't thread-safe, so each worker thread keeps its
+    own service (and connection pool) instead of one global instance.
+    """
+    svc = getattr(_calendar_local, "service", None)
+    if svc is None:
+        svc = build("calendar", "v3", credentials=_calendar_credentials(), cache_discovery=False)
+        _calendar_local.service = svc
+    return svc
@@ -1,15 +1,81 @@
+import logging
 import os
+import re
+from array import array
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 
-import gspread
-from google.oauth2.service_account import Credentials
+import orjson
+from gspread.utils import ValueRenderOption
 
+from .google_clients import get_gspread
+from .sheet_cache import CachedSheet
 
-_SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.readonly",
-]
+
+# canonical property type -> words that mean it in a sheet's type column or a query
+_TYPE_MAP = {
+    "retail": ["retail", "shop", "shop house", "shophouse", "commercial"],
+    "condo": ["condo", "apartment", "คอนโด"],
+    "land": ["land", "ที่ดิน"],
+}
+_TYPE_SYNONYMS = {s: canon for canon, syns in _TYPE_MAP.items() for s in [canon, *syns]}
+# one alternation per canonical type: a single scan instead of one per synonym
+_TYPE_PATTERNS = {
+    canon: re.compile("|".join(map(re.escape, dict.fromkeys([canon, *syns]))))
+    for canon, syns in _TYPE_MAP.items()
+}
+
+
+def _type_groups(type_l: str) -> frozenset:
+    # canonical types whose words appear in a row's type, e.g. "shop house" -> {"retail"}
+    return frozenset(canon for canon, pat in _TYPE_PATTERNS.items() if pat.search(type_l))
+
+
+logger = logging.getLogger(__name__)
+
+# past this age an expired snapshot is no longer served while refreshing; the
+# caller waits for a fresh read instead
+_MAX_STALE = 10 * 60.0
+
+# a snapshot left on disk by an earlier process is only trusted up to this age;
+# until the first refresh lands it is served stale-while-revalidate up to it too
+_DISK_CACHE_MAX_AGE = 24 * 3600.0
+
+# background refreshes of expired snapshots; one at a time is plenty
+_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="properties-refresh")
+
+
+def _paginate(matches: Iterable[Dict[str, Any]], offset: int, limit: Optional[int]) -> Tuple[List[Dict[str, Any]], bool, int]:
+    # (page, has_more, number of matches consumed)
+    page: List[Dict[str, Any]] = []
+    seen = 0
+    for r in matches:
+        if seen >= offset:
+            if limit is not None and len(page) >= limit:
+                return page, True, seen
+            page.append(r)
+        seen += 1
+    return page, False, seen
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _char_bloom(text: str) -> int:
+    # 64-bit set of (folded) characters present; a substring's bits are a subset of its haystack's
+    bits = 0
+    for c in set(text):
+        bits |= 1 << (ord(c) & 63)
+    return bits
+
+
+def _grams(text: str) -> set:
+    # character trigrams; any substring of 3+ chars only contains grams of its haystack
+    return {text[i:i + 3] for i in range(len(text) - 2)}
 
 
 class PropertiesRepository:
@@ -17,105 +83,329 @@ class PropertiesRepository:
         self.sheet_id = os.getenv("GOOGLE_SHEETS_DOCUMENT_ID")
         if not self.sheet_id:
             raise RuntimeError("GOOGLE_SHEETS_DOCUMENT_ID is required")
-        self._cache_data = None
-        self._cache_ts = 0.0
         self._cache_ttl = 30.0
-        # optional: per property calendar mapping (property_id -> calendar_id)
-        self._calendar_map = None
+        self._ws = None
+        self._default_calendar_id = os.getenv('DEFAULT_GOOGLE_CALENDAR_ID')
+        # last sheet read, kept across restarts; set PROPERTIES_CACHE_PATH="" to disable
+        self._disk_path = os.getenv("PROPERTIES_CACHE_PATH", "/tmp/properties_cache.json")
+        # rows and indexes are rebuilt together and swapped in with one
+        # assignment, so readers never see a half-built snapshot
+        self._snap: Optional[CachedSheet] = None
+        self._refresh_lock = threading.Lock()
+        # the disk copy is parsed on first use (off the event loop), not here
+        self._disk_pending = bool(self._disk_path)
+        # the snapshot restored from disk, until a live read replaces it
+        self._restored: Optional[CachedSheet] = None
+
+    def _worksheet(self):
+        if self._ws is None:
+            gc = get_gspread()
+            sh = gc.open_by_key(self.sheet_id)
+            self._ws = sh.worksheet("properties")
+        return self._ws
+
+    def _snapshot(self) -> CachedSheet:
+        snap = self._snap
+        if snap is None and self._disk_pending:
+            with self._refresh_lock:
+                if self._disk_pending:
+                    self._disk_pending = False
+                    self._snap = self._restored = self._load_disk()
+            snap = self._snap
+        if snap is not None and time.time() - snap.ts < self._cache_ttl:
+            return snap
+        # a restored disk copy may be older than _MAX_STALE by design: serve it
+        # while the first live read runs rather than block on Sheets
+        max_stale = _DISK_CACHE_MAX_AGE if snap is self._restored else _MAX_STALE
+        if snap is None or time.time() - snap.ts >= max_stale:
+            # nothing (recent enough) to serve: load synchronously, after any
+            # refresh already in flight
+            with self._refresh_lock:
+                snap = self._snap
+                if snap is None or time.time() - snap.ts >= self._cache_ttl:
+                    snap = self._load()
+                    self._snap = snap
+                    self._restored = None
+                return snap
+        # stale-while-revalidate: answer from the old rows and refresh in the
+        # background, unless a refresh is already in flight
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                _refresher.submit(self._refresh)
+            except RuntimeError:
+                # executor shut down with the interpreter
+                self._refresh_lock.release()
+        return snap
 
-    def _client(self):
-        creds = Credentials.from_service_account_file(
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"], scopes=_SCOPES
-        )
-        return gspread.authorize(creds)
+    def _refresh(self):
+        # runs on the refresher thread, holding the lock taken by _snapshot
+        try:
+            self._snap = self._load()
+            self._restored = None
+        except Exception:
+            logger.warning("Properties refresh failed; serving the previous snapshot", exc_info=True)
+        finally:
+            self._refresh_lock.release()
 
     def _read_all(self) -> List[Dict[str, Any]]:
-        now = time.time()
-        if self._cache_data is not None and now - self._cache_ts < self._cache_ttl:
-            return self._cache_data
-        gc = self._client()
-        sh = gc.open_by_key(self.sheet_id)
-        ws = sh.worksheet("properties")
-        rows = ws.get_all_records()
-        self._cache_data = rows
-        self._cache_ts = now
-        return rows
+        return self._snapshot().rows
+
+    def _load(self) -> CachedSheet:
+        # one values read; unformatted cells arrive typed (prices as numbers,
+        # not "1,200,000"), which get_all_records would re-parse row by row
+        values = self._worksheet().get(value_render_option=ValueRenderOption.unformatted, pad_values=True)
+        snap = self._from_values(values)
+        self._save_disk(values, snap.ts)
+        return snap
+
+    def _from_values(self, values: List[List[Any]]) -> CachedSheet:
+        headers = values[0] if values else []
+        rows = [dict(zip(headers, v)) for v in values[1:]]
+        return CachedSheet(rows, self._build_indexes(rows))
+
+    def _load_disk(self) -> Optional[CachedSheet]:
+        # a restarted worker answers from the previous read; the snapshot keeps
+        # the file's age, so the first lookup also starts a background refresh
+        if not self._disk_path:
+            return None
+        try:
+            with open(self._disk_path, "rb") as f:
+                data = orjson.loads(f.read())
+            if data.get("sheet_id") != self.sheet_id or time.time() - data["ts"] > _DISK_CACHE_MAX_AGE:
+                return None
+            snap = self._from_values(data["values"])
+        except Exception:
+            return None
+        snap.ts = data["ts"]
+        return snap
+
+    def _save_disk(self, values: List[List[Any]], ts: float):
+        if not self._disk_path:
+            return
+        # write then rename, so readers never see a partial file
+        tmp = f"{self._disk_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps({"sheet_id": self.sheet_id, "ts": ts, "values": list(values)}))
+            os.replace(tmp, self._disk_path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _build_indexes(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        id_index: Dict[str, Dict[str, Any]] = {}
+        # optional: per property calendar mapping (property_id -> calendar_id)
+        calendar_by_pid: Dict[str, str] = {}
+        for r in rows:
+            # first row wins, as with the old linear scan
+            pid = str(r.get("id"))
+            if pid not in id_index:
+                id_index[pid] = r
+                if r.get("calendar_id"):
+                    calendar_by_pid[pid] = str(r["calendar_id"])
+            # normalized fields search compares against, computed once per load
+            r["_hay"] = " ".join([
+                str(r.get("neighborhood", "")),
+                str(r.get("address", "")),
+                str(r.get("title", "")),
+            ]).lower()
+            r["_bloom"] = _char_bloom(r["_hay"])
+            r["_tokens"] = frozenset(_WORD.findall(r["_hay"]))
+            r["_type_l"] = str(r.get("type", "")).lower()
+            r["_type_groups"] = _type_groups(r["_type_l"])
+            r["_status_l"] = str(r.get("status", "active")).lower()
+            # blank counts normalize to "", which search lets match any value
+            r["_bedrooms_s"] = str(r.get("bedrooms")) if str(r.get("bedrooms") or "").strip() else ""
+            r["_bathrooms_s"] = str(r.get("bathrooms")) if str(r.get("bathrooms") or "").strip() else ""
+            price = r.get("price", 0)
+            if isinstance(price, (int, float)) and not isinstance(price, bool):
+                r["_price_i"] = int(price)
+            else:
+                try:
+                    r["_price_i"] = int(str(price).replace(",", ""))
+                except Exception:
+                    r["_price_i"] = 0
+        active = [r for r in rows if r["_status_l"] == "active"]
+
+        by_type = defaultdict(list)
+        by_type_group = defaultdict(list)
+        by_bedrooms = defaultdict(list)
+        by_bathrooms = defaultdict(list)
+        by_area_gram = defaultdict(list)
+        # inverted indexes: value -> positions in ``active``, ascending
+        for i, r in enumerate(active):
+            by_type[r["_type_l"]].append(i)
+            for canon in r["_type_groups"]:
+                by_type_group[canon].append(i)
+            by_bedrooms[r["_bedrooms_s"]].append(i)
+            by_bathrooms[r["_bathrooms_s"]].append(i)
+            for g in _grams(r["_hay"]):
+                by_area_gram[g].append(i)
+        # active-row prices ascending, with the matching positions alongside
+        by_price = sorted(range(len(active)), key=lambda i: active[i]["_price_i"])
+        prices = [active[i]["_price_i"] for i in by_price]
+        try:
+            # packed machine ints: a fraction of the memory of int objects, and
+            # bisect works on them unchanged
+            prices = array("q", prices)
+        except OverflowError:
+            pass
+        return {
+            "by_id": id_index,
+            "calendar_by_pid": calendar_by_pid,
+            "active": active,
+            "by_type": dict(by_type),
+            "by_type_group": dict(by_type_group),
+            "by_bedrooms": dict(by_bedrooms),
+            "by_bathrooms": dict(by_bathrooms),
+            "by_area_gram": dict(by_area_gram),
+            "prices": prices,
+            "price_pos": array("q", by_price),
+        }
+
+    @staticmethod
+    def _area_candidates(ix: Dict[str, Any], area: str) -> Optional[set]:
+        # rows holding every trigram of ``area``; a superset of the substring
+        # matches, so callers still check ``_hay``. None when too short to narrow.
+        grams = _grams(area)
+        if not grams:
+            return None
+        postings = sorted((ix["by_area_gram"].get(g, ()) for g in grams), key=len)
+        cand = set(postings[0])
+        for p in postings[1:]:
+            if not cand:
+                break
+            cand.intersection_update(p)
+        return cand
+
+    @staticmethod
+    def _price_candidates(ix: Dict[str, Any], price_min: Optional[int], price_max: Optional[int]) -> set:
+        prices = ix["prices"]
+        lo = bisect_left(prices, price_min) if price_min is not None else 0
+        hi = bisect_right(prices, price_max) if price_max is not None else len(prices)
+        return set(ix["price_pos"][lo:hi])
+
+    def _candidates(self, ix: Dict[str, Any], area: str, canon_type: Optional[str], ptype: str, bedrooms: Optional[str], bathrooms: Optional[str],
+                    price_min: Optional[int] = None, price_max: Optional[int] = None) -> Optional[List[int]]:
+        # positions allowed by the indexed filters, in sheet order; None means scan everything
+        sets = []
+        if (price_min is not None or price_max is not None) and ix["prices"]:
+            sets.append(self._price_candidates(ix, price_min, price_max))
+        if canon_type:
+            sets.append(set(ix["by_type_group"].get(canon_type, ())))
+        elif ptype:
+            # unknown types match by substring, so walk the (few) distinct types rather than the rows
+            sets.append({i for t_l, ids in ix["by_type"].items() if ptype in t_l for i in ids})
+        if bedrooms is not None:
+            by_bedrooms = ix["by_bedrooms"]
+            sets.append(set(by_bedrooms.get(bedrooms, ())).union(by_bedrooms.get("", ())))
+        if bathrooms is not None:
+            by_bathrooms = ix["by_bathrooms"]
+            sets.append(set(by_bathrooms.get(bathrooms, ())).union(by_bathrooms.get("", ())))
+        if area:
+            area_cand = self._area_candidates(ix, area)
+            if area_cand is not None:
+                sets.append(area_cand)
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sorted(sets[0].intersection(*sets[1:]))
 
     def get_calendar_id(self, pid: str) -> Optional[str]:
         # Optional: add a 'calendar_id' column in properties sheet.
-        prop = self.get_by_id(pid)
-        if prop:
-            cid = prop.get('calendar_id')
-            if cid:
-                return str(cid)
-        return os.getenv('DEFAULT_GOOGLE_CALENDAR_ID')
+        cid = self._snapshot().indexes["calendar_by_pid"].get(str(pid))
+        return cid or self._default_calendar_id
+
+    def calendar_id_for(self, prop: Dict[str, Any]) -> Optional[str]:
+        """Calendar id of an already fetched property row; no sheet access."""
+        cid = prop.get('calendar_id')
+        return str(cid) if cid else self._default_calendar_id
 
     def get_by_id(self, pid: str) -> Optional[Dict[str, Any]]:
-        for r in self._read_all():
-            if str(r.get("id")) == str(pid):
-                return r
-        return None
+        return self._snapshot().indexes["by_id"].get(str(pid))
 
-    def search(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
-        rows = [r for r in self._read_all() if str(r.get("status", "active")).lower() == "active"]
+    def get_many(self, pids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """Look up several properties at once; keyed by str(id), missing ids omitted."""
+        by_id = self._snapshot().indexes["by_id"]
+        found: Dict[str, Dict[str, Any]] = {}
+        for pid in pids:
+            r = by_id.get(str(pid))
+            if r is not None:
+                found[str(pid)] = r
+        return found
+
+    def search(self, filters: Dict[str, Any], offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return one page of active properties matching ``filters`` and whether more follow.
+
+        Matching stops once the page and one look-ahead row are found.
+        """
+        ix = self._snapshot().indexes
+        rows = ix["active"]
+        # query values normalized once, not per row
         price_min = filters.get("price_min")
+        price_min = int(price_min) if price_min is not None else None
         price_max = filters.get("price_max")
+        price_max = int(price_max) if price_max is not None else None
         bedrooms = filters.get("bedrooms")
+        bedrooms = str(bedrooms) if bedrooms is not None else None
         bathrooms = filters.get("bathrooms")
+        bathrooms = str(bathrooms) if bathrooms is not None else None
         area = (filters.get("neighborhood") or filters.get("area") or "").strip().lower()
         ptype = (filters.get("property_type") or "").lower()
+        area_bloom = _char_bloom(area)
+        # a single-word area found among a row's words is certainly a substring
+        area_word = area if _WORD.fullmatch(area) else None
 
         # normalize property type synonyms
-        type_map = {
-            "retail": ["retail", "shop", "shop house", "shophouse", "commercial"],
-            "condo": ["condo", "apartment", "คอนโด"],
-            "land": ["land", "ที่ดิน"],
-        }
-        type_targets: List[str] = []
-        if ptype:
-            for k, vals in type_map.items():
-                if ptype == k or ptype in vals:
-                    type_targets = [k] + vals
-                    break
-            if not type_targets:
-                type_targets = [ptype]
+        canon_type = _TYPE_SYNONYMS.get(ptype) if ptype else None
 
         def ok(r: Dict[str, Any]) -> bool:
-            # price
-            try:
-                price = int(str(r.get("price", 0)).replace(",", ""))
-            except Exception:
-                price = 0
-            if price_min is not None and price < int(price_min):
-                return False
-            if price_max is not None and price > int(price_max):
-                return False
+            # cheapest checks first; the substring tests run last
+            # property type synonyms
+            if canon_type:
+                if canon_type not in r["_type_groups"]:
+                    return False
             # bedrooms/bathrooms (optional in your sheet; skip if blank)
-            if bedrooms is not None and str(r.get("bedrooms") or "").strip():
-                if str(r.get("bedrooms")) != str(bedrooms):
+            if bedrooms is not None:
+                beds = r["_bedrooms_s"]
+                if beds and beds != bedrooms:
                     return False
-            if bathrooms is not None and str(r.get("bathrooms") or "").strip():
-                if str(r.get("bathrooms")) != str(bathrooms):
+            if bathrooms is not None:
+                baths = r["_bathrooms_s"]
+                if baths and baths != bathrooms:
                     return False
+            # price
+            if price_min is not None and r["_price_i"] < price_min:
+                return False
+            if price_max is not None and r["_price_i"] > price_max:
+                return False
+            if not canon_type and ptype and ptype not in r["_type_l"]:
+                return False
             # area match in neighborhood OR address OR title
-            if area:
-                hay = " ".join([
-                    str(r.get("neighborhood", "")),
-                    str(r.get("address", "")),
-                    str(r.get("title", "")),
-                ]).lower()
-                if area not in hay:
-                    return False
-            # property type synonyms
-            if type_targets:
-                hay2 = str(r.get("type", "")).lower()
-                if not any(t in hay2 for t in type_targets):
-                    return False
+            if area and not area_ok(r):
+                return False
             return True
 
-        results = [r for r in rows if ok(r)]
+        def area_ok(r: Dict[str, Any]) -> bool:
+            # word hit first; otherwise the bloom-guarded substring test decides
+            if area_word is not None and area_word in r["_tokens"]:
+                return True
+            return r["_bloom"] & area_bloom == area_bloom and area in r["_hay"]
+
+        cand = self._candidates(ix, area, canon_type, ptype, bedrooms, bathrooms, price_min, price_max)
+        scan = rows if cand is None else (rows[i] for i in cand)
+        page, has_more, matched = _paginate((r for r in scan if ok(r)), offset, limit)
         # graceful degradation: if area specified but no result, drop bedrooms/bathrooms first, then price
-        if not results and area:
-            results = [r for r in rows if area in (" ".join([str(r.get("neighborhood","")), str(r.get("address","")), str(r.get("title",""))]).lower())]
-        return results
+        if not matched and area:
+            area_cand = self._area_candidates(ix, area)
+            scan = rows if area_cand is None else (rows[i] for i in sorted(area_cand))
+            page, has_more, _ = _paginate(
+                (r for r in scan if area_ok(r)),
+                offset,
+                limit,
+            )
+        return page, has_more
 
@@ -1,15 +1,13 @@
 import os
 import time
-import json
+import threading
 from typing import Dict, Any
 
-import gspread
-from google.oauth2.service_account import Credentials
+import orjson
+from gspread.utils import rowcol_to_a1
 
-
-_SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-]
+from .google_clients import get_gspread
+from .sheet_cache import appended_row
 
 
 class SessionsRepository:
@@ -17,36 +15,66 @@ class SessionsRepository:
         self.sheet_id = os.getenv("GOOGLE_SHEETS_DOCUMENT_ID")
         if not self.sheet_id:
             raise RuntimeError("GOOGLE_SHEETS_DOCUMENT_ID is required")
-
-    def _client(self):
-        creds = Credentials.from_service_account_file(
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"], scopes=_SCOPES
-        )
-        return gspread.authorize(creds)
+        self._ws = None
+        # loaded from the sheet on first use, then kept in step by set_context
+        # _lock guards the dicts only; _append_lock keeps a new user from being
+        # appended twice. Neither is held across an existing row's write.
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._loaded = False
+        self._col: Dict[str, int] = {}
+        self._row_by_uid: Dict[str, int] = {}
+        self._ctx_by_uid: Dict[str, str] = {}
 
     def _worksheet(self):
-        gc = self._client()
+        if self._ws is not None:
+            return self._ws
+        gc = get_gspread()
         sh = gc.open_by_key(self.sheet_id)
         try:
             ws = sh.worksheet("sessions")
         except Exception:
             ws = sh.add_worksheet(title="sessions", rows=1000, cols=5)
             ws.update("A1", [["user_id", "context_json", "updated_at"]])
+        self._ws = ws
         return ws
 
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            # one read covers both the header positions and the rows
+            values = self._worksheet().get(pad_values=True)
+            headers = values[0] if values else []
+            row_by_uid: Dict[str, int] = {}
+            ctx_by_uid: Dict[str, str] = {}
+            for row_num, v in enumerate(values[1:], start=2):
+                r = dict(zip(headers, v))
+                uid = str(r.get("user_id"))
+                # first row wins, as with the old linear scan
+                if uid not in row_by_uid:
+                    row_by_uid[uid] = row_num
+                    ctx_by_uid[uid] = r.get("context_json") or "{}"
+            self._col = {h: i + 1 for i, h in enumerate(headers)}
+            self._row_by_uid = row_by_uid
+            self._ctx_by_uid = ctx_by_uid
+            self._loaded = True
+
     def get_context(self, user_id: str) -> Dict[str, Any]:
         try:
             if not user_id:
                 return {}
-            ws = self._worksheet()
-            records = ws.get_all_records()
-            for r in records:
-                if str(r.get("user_id")) == str(user_id):
-                    try:
-                        return json.loads(r.get("context_json") or "{}")
-                    except Exception:
-                        return {}
-            return {}
+            self._ensure_loaded()
+            raw = self._ctx_by_uid.get(str(user_id))
+            if raw is None:
+                return {}
+            # kept as JSON so every caller gets its own copy to mutate
+            try:
+                return orjson.loads(raw)
+            except Exception:
+                return {}
         except Exception:
             return {}
 
@@ -54,20 +82,45 @@ class SessionsRepository:
         try:
             if not user_id:
                 return
+            self._ensure_loaded()
             ws = self._worksheet()
-            records = ws.get_all_records()
-            headers = ws.row_values(1)
-            uid_idx = headers.index("user_id") + 1
-            ctx_idx = headers.index("context_json") + 1
-            ts_idx = headers.index("updated_at") + 1
-            row_num = 2
-            for r in records:
-                if str(r.get("user_id")) == str(user_id):
-                    ws.update_cell(row_num, ctx_idx, json.dumps(context))
-                    ws.update_cell(row_num, ts_idx, time.strftime("%Y-%m-%d %H:%M:%S"))
-                    return
-                row_num += 1
-            ws.append_row([user_id, json.dumps(context), time.strftime("%Y-%m-%d %H:%M:%S")])
+            uid = str(user_id)
+            # json.dumps accepted non-string keys too; keep that
+            raw = orjson.dumps(context, option=orjson.OPT_NON_STR_KEYS).decode()
+            ts_now = time.strftime("%Y-%m-%d %H:%M:%S")
+            with self._lock:
+                row_num = self._row_by_uid.get(uid)
+            if row_num is None:
+                with self._append_lock:
+                    # another thread may have added this user while we waited
+                    with self._lock:
+                        row_num = self._row_by_uid.get(uid)
+                    if row_num is None:
+                        res = ws.append_row([user_id, raw, ts_now])
+                        row_num = appended_row(res)
+                        with self._lock:
+                            if row_num is None:
+                                # can't tell where the row landed; re-read on next use
+                                self._loaded = False
+                                return
+                            self._row_by_uid[uid] = row_num
+                            self._ctx_by_uid[uid] = raw
+                        return
+            ctx_idx = self._col["context_json"]
+            ts_idx = self._col["updated_at"]
+            if ts_idx == ctx_idx + 1:
+                # the default layout: both cells as one range
+                data = [{
+                    "range": f"{rowcol_to_a1(row_num, ctx_idx)}:{rowcol_to_a1(row_num, ts_idx)}",
+                    "values": [[raw, ts_now]],
+                }]
+            else:
+                data = [
+                    {"range": rowcol_to_a1(row_num, ctx_idx), "values": [[raw]]},
+                    {"range": rowcol_to_a1(row_num, ts_idx), "values": [[ts_now]]},
+                ]
+            ws.batch_update(data)
+            with self._lock:
+                self._ctx_by_uid[uid] = raw
         except Exception:
             return
-
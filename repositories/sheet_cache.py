@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from gspread.utils import a1_to_rowcol
+
+
+class CachedSheet:
+    """Rows of one worksheet plus the lookup indexes derived from them.
+
+    ``version`` is the spreadsheet revision the rows were read at, if known.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], indexes: Dict[str, Any], version: Optional[str] = None):
+        self.rows = rows
+        self.indexes = indexes
+        self.version = version
+        self.ts = time.time()
+
+
+class SheetCache:
+    """Process-wide TTL cache of worksheets shared by all repository instances.
+
+    Loads are serialized per key so concurrent misses trigger a single fetch.
+    When a ``version`` callable is given, an expired entry is first checked
+    against the current spreadsheet revision and kept if nothing changed.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedSheet] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def peek(self, key: str) -> Optional[CachedSheet]:
+        return self._entries.get(key)
+
+    @staticmethod
+    def _revalidate(entry: CachedSheet, version: Optional[Callable[[], str]]) -> bool:
+        if version is None or entry.version is None:
+            return False
+        try:
+            unchanged = version() == entry.version
+        except Exception:
+            return False
+        if unchanged:
+            entry.ts = time.time()
+        return unchanged
+
+    def fresh(self, key: str, ttl: float, version: Optional[Callable[[], str]] = None) -> Optional[CachedSheet]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.ts < ttl or self._revalidate(entry, version):
+            return entry
+        return None
+
+    def get(
+        self,
+        key: str,
+        ttl: float,
+        load: Callable[[], CachedSheet],
+        version: Optional[Callable[[], str]] = None,
+    ) -> CachedSheet:
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.ts < ttl:
+            return entry
+        with self._lock_for(key):
+            # another thread may have refreshed while we waited
+            entry = self._entries.get(key)
+            if entry is not None and (time.time() - entry.ts < ttl or self._revalidate(entry, version)):
+                return entry
+            entry = load()
+            self._entries[key] = entry
+            return entry
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+
+sheet_cache = SheetCache()
+
+
+def appended_row(res: Any) -> Optional[int]:
+    """Sheet row an append_row() landed on, from its "updatedRange" (e.g. "bookings!A42:H42")."""
+    try:
+        updated = res["updates"]["updatedRange"]
+        return a1_to_rowcol(updated.split("!")[-1].split(":")[0])[0]
+    except Exception:
+        return None
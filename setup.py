@@ -0,0 +1,13 @@
+# Optional mypyc build of the pure-Python hot paths:
+#
+#     pip install mypy setuptools && python setup.py build_ext --inplace
+#
+# Without it the plain .py modules are imported as usual.
+from setuptools import setup
+from mypyc.build import mypycify
+
+
+setup(
+    name="cloudrental-agent",
+    ext_modules=mypycify(["intent_rules.py", "flex_templates.py"]),
+)
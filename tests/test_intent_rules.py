@@ -0,0 +1,54 @@
+import asyncio
+import os
+import unittest
+
+from intent_rules import refines_context, regex_intent
+
+
+class RefinesContextTest(unittest.TestCase):
+    def test_partial_search_after_search_needs_context(self):
+        ctx = {"last_filters": {"neighborhood": "ari", "property_type": "condo"}, "last_action": "search"}
+        intent = regex_intent("under 20k")
+        self.assertEqual(intent["name"], "search")
+        self.assertTrue(refines_context(intent, ctx))
+
+    def test_full_restatement_stays_on_regex(self):
+        ctx = {"last_filters": {"neighborhood": "ari", "property_type": "condo"}}
+        self.assertFalse(refines_context(regex_intent("2br condo in ari"), ctx))
+
+    def test_no_prior_search(self):
+        self.assertFalse(refines_context(regex_intent("under 20k"), {}))
+        self.assertFalse(refines_context(regex_intent("under 20k"), None))
+        self.assertFalse(refines_context(regex_intent("browse"), {"last_filters": {"neighborhood": "ari"}}))
+
+
+class ParseIntentFollowUpTest(unittest.TestCase):
+    def test_follow_up_goes_to_gemini_with_context(self):
+        os.environ["GEMINI_API_KEY"] = "test"
+        from gemini_client import GeminiNLU
+
+        calls = []
+
+        async def run():
+            nlu = GeminiNLU()
+
+            async def fake_gemini(user_text, session_context):
+                calls.append((user_text, session_context))
+                return {"name": "search", "filters": dict(session_context["last_filters"], price_max=20000)}
+
+            nlu._parse_with_gemini = fake_gemini
+            ctx = {"last_filters": {"neighborhood": "ari", "property_type": "condo"}, "last_action": "search"}
+            follow_up = await nlu.parse_intent("under 20k", ctx)
+            fresh = await nlu.parse_intent("under 20k", {})
+            return follow_up, fresh
+
+        follow_up, fresh = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][1]["last_filters"]["neighborhood"], "ari")
+        self.assertEqual(follow_up["filters"], {"neighborhood": "ari", "property_type": "condo", "price_max": 20000})
+        # without prior search state the regex answer stands
+        self.assertEqual(fresh, {"name": "search", "filters": {"price_max": 20000}})
+
+
+if __name__ == "__main__":
+    unittest.main()